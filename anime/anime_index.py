@@ -0,0 +1,139 @@
+import functools
+import sqlite3
+import time
+import os
+
+# Read-only SQLite index shared by all workers through the OS page cache
+INDEX_PATH = './cache/anime/index.sqlite'
+INDEX_CHECK_INTERVAL = 30
+MMAP_SIZE = 64 * 1024 * 1024
+INTERVALS_CACHE_SIZE = 1024
+
+connection = None
+connection_inode = None
+checked_at = 0
+
+
+def build(kitsu_map: dict, mal_map: dict, imdb_map: dict) -> None:
+    """
+    Write the index in a temporary file and swap it in atomically,
+    open connections keep reading the previous file.
+    """
+    os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
+    tmp_path = f"{INDEX_PATH}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    db = sqlite3.connect(tmp_path)
+    try:
+        db.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE kitsu (kitsu_id INTEGER PRIMARY KEY, imdb_id TEXT NOT NULL);
+            CREATE TABLE mal (mal_id INTEGER PRIMARY KEY, imdb_id TEXT NOT NULL);
+            CREATE TABLE anime (imdb_id TEXT PRIMARY KEY) WITHOUT ROWID;
+            CREATE TABLE seasons (imdb_id TEXT NOT NULL, position INTEGER NOT NULL, kitsu_id TEXT NOT NULL, season INTEGER, epoffset INTEGER, PRIMARY KEY (imdb_id, position)) WITHOUT ROWID;
+        """)
+        db.executemany("INSERT INTO kitsu VALUES (?, ?)", kitsu_map.items())
+        db.executemany("INSERT INTO mal VALUES (?, ?)", mal_map.items())
+        db.executemany("INSERT INTO anime VALUES (?)", ((imdb_id,) for imdb_id in imdb_map))
+        db.executemany("INSERT INTO seasons VALUES (?, ?, ?, ?, ?)", (
+            (imdb_id, position, kitsu_id, values['season'], values['epoffset'])
+            for imdb_id, item in imdb_map.items()
+            for position, entry in enumerate(item['kitsu_ids'])
+            for kitsu_id, values in entry.items()
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+    os.replace(tmp_path, INDEX_PATH)
+    reload()
+
+
+def is_fresh(max_age: float) -> bool:
+    try:
+        return time.time() - os.path.getmtime(INDEX_PATH) < max_age
+    except OSError:
+        return False
+
+
+def reload() -> None:
+    global checked_at
+    checked_at = 0
+
+
+def get_connection() -> sqlite3.Connection | None:
+    """
+    Lazy connection, reopened when another worker swapped the index file.
+    """
+    global connection, connection_inode, checked_at
+    now = time.monotonic()
+    if connection != None and now - checked_at < INDEX_CHECK_INTERVAL:
+        return connection
+
+    checked_at = now
+    try:
+        inode = os.stat(INDEX_PATH).st_ino
+    except OSError:
+        return connection
+
+    if connection == None or inode != connection_inode:
+        if connection != None:
+            connection.close()
+        connection = sqlite3.connect(f"file:{os.path.abspath(INDEX_PATH)}?mode=ro", uri=True, check_same_thread=False)
+        connection.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        connection_inode = inode
+        kitsu_intervals.cache_clear()
+    return connection
+
+
+def query_one(sql: str, params: tuple):
+    db = get_connection()
+    if db == None:
+        return None
+    return db.execute(sql, params).fetchone()
+
+
+def kitsu_to_imdb(kitsu_id: int) -> str | None:
+    row = query_one("SELECT imdb_id FROM kitsu WHERE kitsu_id = ?", (kitsu_id,))
+    return row[0] if row else None
+
+
+def mal_to_imdb(mal_id: int) -> str | None:
+    row = query_one("SELECT imdb_id FROM mal WHERE mal_id = ?", (mal_id,))
+    return row[0] if row else None
+
+
+def is_anime(imdb_id: str) -> bool:
+    return query_one("SELECT 1 FROM anime WHERE imdb_id = ?", (imdb_id,)) != None
+
+
+# Kitsu ids of an imdb id, sorted by season and episode offset
+def kitsu_seasons(imdb_id: str) -> list[dict]:
+    db = get_connection()
+    if db == None:
+        return []
+    rows = db.execute("SELECT kitsu_id, season, epoffset FROM seasons WHERE imdb_id = ? ORDER BY position", (imdb_id,))
+    return [{kitsu_id: {"season": season, "epoffset": epoffset}} for kitsu_id, season, epoffset in rows]
+
+
+@functools.lru_cache(maxsize=INTERVALS_CACHE_SIZE)
+def kitsu_intervals(imdb_id: str) -> dict:
+    """
+    Per season sorted episode offsets and their kitsu ids, searchable with bisect.
+    Between equal offsets the last entry wins.
+    """
+    intervals = {}
+    for entry in kitsu_seasons(imdb_id):
+        for kitsu_id, values in entry.items():
+            if values['season'] == None:
+                continue
+            offsets, kitsu_ids = intervals.setdefault(values['season'], ([], []))
+            epoffset = values['epoffset'] or 0
+            if offsets and offsets[-1] == epoffset:
+                kitsu_ids[-1] = kitsu_id
+            else:
+                offsets.append(epoffset)
+                kitsu_ids.append(kitsu_id)
+    return intervals
@@ -1,7 +1,11 @@
+from api import http_client
+from anime import anime_index
+from datetime import timedelta
 import httpx
 import bisect
 import json
 import asyncio
+import os
 
 # Map for IDs
 anime_mapping_url = 'https://raw.githubusercontent.com/Fribb/anime-lists/refs/heads/master/anime-list-full.json'
@@ -11,6 +15,22 @@ anime_id_map = None
 anime_db_map_url = 'https://raw.githubusercontent.com/Kometa-Team/Anime-IDs/master/anime_ids.json'
 anime_season_map = None
 
+# Index built by another worker in the meantime is reused
+INDEX_REUSE_AGE = timedelta(minutes=10).total_seconds()
+
+# Downloaded lists snapshot, refreshed in background with conditional requests
+MAPS_DIR = './cache/anime'
+MAP_VALIDATORS_PATH = f"{MAPS_DIR}/validators.json"
+MAP_SOURCES = {
+    'anime-list-full.json': anime_mapping_url,
+    'anime_ids.json': anime_db_map_url
+}
+MAP_REFRESH_INTERVAL = timedelta(hours=24).total_seconds()
+MAP_RETRY_INTERVAL = timedelta(minutes=10).total_seconds()
+
+maps_lock = asyncio.Lock()
+refresh_task = None
+
 # Load anidb Extension from file
 with open("anime/anidb_extension.json", "r", encoding="utf-8") as f:
     anidb_extension = json.load(f) 
@@ -19,17 +39,114 @@ with open("anime/anidb_extension.json", "r", encoding="utf-8") as f:
 with open("anime/anime_mapping_extension.json", "r", encoding="utf-8") as f:
     anime_mapping_extension = json.load(f) 
 
-async def download_maps():
-    global anime_id_map, anime_season_map
-    async with httpx.AsyncClient(timeout=20) as client:
-        tasks = [
-            client.get(anime_mapping_url),
-            client.get(anime_db_map_url)
-        ]
+async def download_maps(force: bool = False) -> bool:
+    """
+    Scarica solo le liste modificate (ETag / Last-Modified) e ricostruisce l'indice.
+    Ritorna True se l'indice e' stato ricostruito.
+    """
+    async with maps_lock:
+        if not force and anime_index.is_fresh(INDEX_REUSE_AGE):
+            return False
+
+        validators = await asyncio.to_thread(load_validators)
+        tasks = [download_map(name, url, validators.get(name, {})) for name, url in MAP_SOURCES.items()]
         results = await asyncio.gather(*tasks)
-        anime_id_map = results[0].json() + anime_mapping_extension
-        anime_season_map = {**results[1].json(), **anidb_extension}
-        
+
+        changed = { name: result for name, result in zip(MAP_SOURCES, results) if result != None }
+        if changed or force or not os.path.exists(anime_index.INDEX_PATH):
+            await asyncio.to_thread(build_index)
+            validators.update(changed)
+            await asyncio.to_thread(save_validators, validators)
+            return True
+
+        # Not modified, mark the index as checked for the other workers
+        os.utime(anime_index.INDEX_PATH)
+        return False
+
+
+async def download_map(name: str, url: str, validator: dict) -> dict | None:
+    """
+    Richiesta condizionale, salva la lista su disco e ritorna i nuovi validatori
+    (None se non modificata)
+    """
+    path = f"{MAPS_DIR}/{name}"
+    headers = {}
+    if os.path.exists(path):
+        if validator.get('etag'):
+            headers['If-None-Match'] = validator['etag']
+        if validator.get('last_modified'):
+            headers['If-Modified-Since'] = validator['last_modified']
+
+    response = await http_client.get_client('github').get(url, headers=headers)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+
+    await asyncio.to_thread(write_atomic, path, response.content)
+    return {
+        'etag': response.headers.get('etag'),
+        'last_modified': response.headers.get('last-modified')
+    }
+
+
+def build_index():
+    """
+    Scrive le mappe nell'indice condiviso e libera le liste originali
+    """
+    global anime_id_map, anime_season_map
+    with open(f"{MAPS_DIR}/anime-list-full.json", "r", encoding="utf-8") as f:
+        anime_id_map = json.load(f) + anime_mapping_extension
+    with open(f"{MAPS_DIR}/anime_ids.json", "r", encoding="utf-8") as f:
+        anime_season_map = {**json.load(f), **anidb_extension}
+
+    anime_index.build(load_kitsu_map(), load_mal_map(), load_imdb_map())
+    anime_id_map = None
+    anime_season_map = None
+
+
+# Background refresh, the last index is served in the meantime
+async def refresh_maps():
+    while True:
+        try:
+            await download_maps()
+        except Exception as e:
+            print(f"Anime map refresh error: {e!r}")
+            delay = MAP_RETRY_INTERVAL
+        else:
+            delay = MAP_REFRESH_INTERVAL
+        await asyncio.sleep(delay)
+
+
+def start_refresh():
+    global refresh_task
+    refresh_task = asyncio.create_task(refresh_maps())
+
+
+async def stop_refresh():
+    if refresh_task != None:
+        refresh_task.cancel()
+        await asyncio.gather(refresh_task, return_exceptions=True)
+
+
+def load_validators() -> dict:
+    try:
+        with open(MAP_VALIDATORS_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_validators(validators: dict):
+    write_atomic(MAP_VALIDATORS_PATH, json.dumps(validators).encode('utf-8'))
+
+
+def write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
 
 def load_kitsu_map() -> dict:
     """
@@ -130,18 +247,18 @@ def insert_sorted_kitsu_insort(kitsu_list, kitsu_id, season, epoffset):
     # crea una chiave per ordinamento
     new_key = (season or 0, epoffset or 0)
 
-    # crea una lista ausiliaria di chiavi
-    keys = [(list(entry.values())[0].get("season") or 0,
-             list(entry.values())[0].get("epoffset") or 0)
-            for entry in kitsu_list]
-
     # trova la posizione di inserimento
-    idx = bisect.bisect_left(keys, new_key)
+    idx = bisect.bisect_left(kitsu_list, new_key, key=kitsu_sort_key)
 
     # inserisci il dict nella posizione corretta
     kitsu_list.insert(idx, new_entry)
 
 
+def kitsu_sort_key(entry: dict) -> tuple:
+    values = next(iter(entry.values()))
+    return (values.get("season") or 0, values.get("epoffset") or 0)
+
+
 def load_anidb_map():
     map = httpx.Client().get(anime_db_map_url).json()
     return map
@@ -1,7 +1,9 @@
 from cache import Cache
 from datetime import timedelta
-import httpx
-import anime.anime_mapping as anime_mapping
+from api import http_client
+from anime import anime_index
+import bisect
+import ttl_policy
 
 kitsu_addon_url = 'https://anime-kitsu.strem.fun'
 
@@ -9,34 +11,32 @@ kitsu_addon_url = 'https://anime-kitsu.strem.fun'
 kitsu_cache_ids = Cache('./cache/kitsu/ids', timedelta(days=30).total_seconds())
 #kitsu_cache_ids.clear()
 
-# Anime mapping loading
-imdb_ids_map = None
-imdb_map = None
-
-def load_anime_map():
-	global imdb_ids_map, imdb_map
-	# Load kitsu -> imdb converter
-	imdb_map = anime_mapping.load_kitsu_map()
-	for kitsu_id, imdb_id in imdb_map.items():
-		kitsu_cache_ids.set(f"kitsu:{kitsu_id}", imdb_id)
-
-	# Load season / episode map
-	imdb_ids_map = anime_mapping.load_imdb_map()
+# Conversion from the shared anime index
+def get_mapped_imdb(kitsu_id: str) -> str | None:
+	try:
+		return anime_index.kitsu_to_imdb(int(kitsu_id.split(':')[1]))
+	except (IndexError, ValueError):
+		return None
 
 async def convert_to_imdb(kitsu_id: str, type: str):
 	is_converted = False
-	imdb_id = kitsu_cache_ids.get(kitsu_id)
+	imdb_id = get_mapped_imdb(kitsu_id)
 	if imdb_id == None:
-		async with httpx.AsyncClient(follow_redirects=True, timeout=20) as client:
-			response = await client.get(f"{kitsu_addon_url}/meta/{type}/{kitsu_id.replace(':','%3A')}.json")
-			try:
-				imdb_id = response.json()['meta']['imdb_id']
-				kitsu_cache_ids.set(kitsu_id, imdb_id)
-				is_converted = True
-			except:
-				# If imdb_id not found save kitsu_id as imdb_id (better performance)
-				kitsu_cache_ids.set(kitsu_id, kitsu_id)
-				return kitsu_id, is_converted
+		imdb_id = await kitsu_cache_ids.aget(kitsu_id)
+	if imdb_id == None:
+		response = await http_client.get_client('kitsu').get(f"{kitsu_addon_url}/meta/{type}/{kitsu_id.replace(':','%3A')}.json")
+		try:
+			imdb_id = response.json()['meta']['imdb_id']
+		except:
+			imdb_id = None
+
+		if imdb_id:
+			kitsu_cache_ids.set(kitsu_id, imdb_id)
+			is_converted = True
+		else:
+			# If imdb_id not found save kitsu_id as imdb_id until the negative TTL
+			kitsu_cache_ids.set(kitsu_id, kitsu_id, ttl_policy.NEGATIVE_TTL)
+			return kitsu_id, is_converted
 	else:
 		if 'tt' not in imdb_id:
 			is_converted = False
@@ -47,25 +47,39 @@ async def convert_to_imdb(kitsu_id: str, type: str):
 
 
 def parse_meta_videos(videos: dict, imdb_id: str) -> dict:
-	kitsu_ids = imdb_ids_map[imdb_id]['kitsu_ids']
+	intervals = anime_index.kitsu_intervals(imdb_id)
 	special_offset = 0
 	videos = sorted(videos, key=lambda x: (x["season"], x["episode"]))
 	
 	for i, video in enumerate(videos):
 		if video['season'] != 0:
-			for item in kitsu_ids:
-				kitsu_id = next(iter(item.keys()))
-				if (item[kitsu_id]['season'] == video['season'] or item[kitsu_id]['season'] == -1) and item[kitsu_id]['epoffset'] < video['episode']:
-					if item[kitsu_id]['season'] == -1:
-						videos[i]['id'] = f"kitsu:{kitsu_id}:{(i - special_offset) + 1}"
-					else:
-						videos[i]['id'] = f"kitsu:{kitsu_id}:{video['episode'] - item[kitsu_id]['epoffset']}"
+			# Season entries first, then the absolute numbering ones (season -1)
+			match = find_interval(intervals.get(video['season']), video['episode'])
+			if match != None:
+				kitsu_id, epoffset = match
+				videos[i]['id'] = f"kitsu:{kitsu_id}:{video['episode'] - epoffset}"
+			else:
+				match = find_interval(intervals.get(-1), video['episode'])
+				if match != None:
+					kitsu_id, epoffset = match
+					videos[i]['id'] = f"kitsu:{kitsu_id}:{(i - special_offset) + 1}"
 		else:
 			special_offset += 1
 
 	return videos
 
 
+# Kitsu id with the greatest episode offset lower than the episode
+def find_interval(interval: tuple | None, episode: int) -> tuple | None:
+	if interval == None:
+		return None
+	offsets, kitsu_ids = interval
+	idx = bisect.bisect_left(offsets, episode) - 1
+	if idx < 0:
+		return None
+	return kitsu_ids[idx], offsets[idx]
+
+
 
 """
 Esempio Attacco dei giganti
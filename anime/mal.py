@@ -1,7 +1,8 @@
 from cache import Cache
 from datetime import timedelta
-import httpx
-import anime.anime_mapping as anime_mapping
+from api import http_client
+from anime import anime_index
+import ttl_policy
 
 kitsu_addon_url = 'https://anime-kitsu.strem.fun'
 
@@ -10,34 +11,32 @@ kitsu_addon_url = 'https://anime-kitsu.strem.fun'
 mal_cache_ids = Cache('./cache/mal/ids', timedelta(days=30).total_seconds())
 #mal_cache_ids.clear()
 
-# Anime mapping loading
-imdb_ids_map = None
-imdb_map = None
-
-def load_anime_map():
-	global imdb_ids_map, imdb_map
-	# Load MAL -> IMDB converter
-	imdb_map = anime_mapping.load_mal_map()
-	for mal_id, imdb_id in imdb_map.items():
-		mal_cache_ids.set(f"mal:{mal_id}", imdb_id)
-
-	# Load season / episode map
-	imdb_ids_map = anime_mapping.load_imdb_map()
+# Conversion from the shared anime index
+def get_mapped_imdb(mal_id: str) -> str | None:
+	try:
+		return anime_index.mal_to_imdb(int(mal_id.split(':')[1]))
+	except (IndexError, ValueError):
+		return None
 
 async def convert_to_imdb(mal_id: str, type: str) -> str:
 	is_converted = False
-	imdb_id = mal_cache_ids.get(mal_id)
+	imdb_id = get_mapped_imdb(mal_id)
+	if imdb_id == None:
+		imdb_id = await mal_cache_ids.aget(mal_id)
 	if imdb_id == None:
-		async with httpx.AsyncClient(follow_redirects=True, timeout=20) as client:
-			response = await client.get(f"{kitsu_addon_url}/meta/{type}/{mal_id.replace(':','%3A')}.json")
-			try:
-				imdb_id = response.json()['meta']['imdb_id']
-				mal_cache_ids.set(mal_id, imdb_id)
-				is_converted = True
-			except:
-				# If imdb_id not found save mal_id as imdb_id (better performance)
-				mal_cache_ids.set(mal_id, mal_id)
-				return mal_id, is_converted
+		response = await http_client.get_client('kitsu').get(f"{kitsu_addon_url}/meta/{type}/{mal_id.replace(':','%3A')}.json")
+		try:
+			imdb_id = response.json()['meta']['imdb_id']
+		except:
+			imdb_id = None
+
+		if imdb_id:
+			mal_cache_ids.set(mal_id, imdb_id)
+			is_converted = True
+		else:
+			# If imdb_id not found save mal_id as imdb_id until the negative TTL
+			mal_cache_ids.set(mal_id, mal_id, ttl_policy.NEGATIVE_TTL)
+			return mal_id, is_converted
 	else:
 		if 'tt' not in imdb_id:
 			is_converted = False
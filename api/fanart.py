@@ -1,3 +1,5 @@
+from api import http_client
+import ttl_policy
 import httpx
 import os
 
@@ -7,23 +9,33 @@ import os
 FANART_API_KEY = os.getenv('FANART_API_KEY')
 
 
-async def get_fanart_movie(client: httpx.AsyncClient, id: str) -> dict:
+async def get_fanart_movie(id: str) -> dict:
     params = {
         "api_key": FANART_API_KEY
     }
 
     url = f"http://webservice.fanart.tv/v3/movies/{id}"
-    reponse = await client.get(url, params=params)
+    try:
+        reponse = await http_client.get_client('fanart').get(url, params=params)
+    except httpx.HTTPError as e:
+        print(f"Fanart failed fetch: {e!r}")
+        ttl_policy.mark_degraded()
+        return {}
 
     return reponse.json()
 
 
-async def get_fanart_series(client: httpx.AsyncClient, id: str) -> dict:
+async def get_fanart_series(id: str) -> dict:
     params = {
         "api_key": FANART_API_KEY
     }
 
     url = f"http://webservice.fanart.tv/v3/tv/{id}"
-    reponse = await client.get(url, params=params)
+    try:
+        reponse = await http_client.get_client('fanart').get(url, params=params)
+    except httpx.HTTPError as e:
+        print(f"Fanart failed fetch: {e!r}")
+        ttl_policy.mark_degraded()
+        return {}
 
     return reponse.json()
\ No newline at end of file
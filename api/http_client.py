@@ -0,0 +1,102 @@
+import importlib.util
+import tracing
+import metrics
+import httpx
+import time
+import os
+
+# HTTP/2 needs the optional h2 package (pip install httpx[http2])
+HTTP2 = os.getenv('HTTP2', '0') == '1' and importlib.util.find_spec('h2') is not None
+KEEPALIVE_EXPIRY = 30
+
+# Send every upstream request to a single server (benchmarks), the original host stays in the Host header
+UPSTREAM_OVERRIDE = os.getenv('UPSTREAM_OVERRIDE')
+
+# Connection settings for every upstream
+UPSTREAMS = {
+    'tmdb': { 'timeout': 20, 'max_connections': 100, 'max_keepalive': 50 },
+    'tvdb': { 'timeout': 30, 'max_connections': 20, 'max_keepalive': 10 },
+    'fanart': { 'timeout': 10, 'max_connections': 20, 'max_keepalive': 10 },
+    'cinemeta': { 'timeout': 20, 'max_connections': 50, 'max_keepalive': 20 },
+    'kitsu': { 'timeout': 20, 'max_connections': 20, 'max_keepalive': 10 },
+    'translator': { 'timeout': 20, 'max_connections': 50, 'max_keepalive': 20 },
+    'github': { 'timeout': 60, 'max_connections': 4, 'max_keepalive': 2 },
+    # User configured catalog addons
+    'addon': { 'timeout': 120, 'max_connections': 200, 'max_keepalive': 50 }
+}
+
+clients: dict[str, httpx.AsyncClient] = {}
+
+
+class OverrideTransport(httpx.AsyncHTTPTransport):
+
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = httpx.URL(base_url)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = request.url.copy_with(scheme=self.base_url.scheme, host=self.base_url.host, port=self.base_url.port)
+        return await super().handle_async_request(request)
+
+
+# Every upstream call is recorded in the metrics and in the trace of the request that made it
+class TracingTransport(httpx.AsyncBaseTransport):
+
+    def __init__(self, upstream: str, transport: httpx.AsyncBaseTransport):
+        self.upstream = upstream
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except Exception:
+            duration = time.perf_counter() - start
+            tracing.record_call(self.upstream, duration, error=True)
+            metrics.observe_upstream(self.upstream, duration, None)
+            raise
+        duration = time.perf_counter() - start
+        tracing.record_call(self.upstream, duration, error=response.status_code == 429 or response.status_code >= 500)
+        metrics.observe_upstream(self.upstream, duration, response.status_code)
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def create_client(upstream: str) -> httpx.AsyncClient:
+    settings = UPSTREAMS[upstream]
+    limits = httpx.Limits(
+        max_connections=settings['max_connections'],
+        max_keepalive_connections=settings['max_keepalive'],
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    )
+    if UPSTREAM_OVERRIDE:
+        transport = OverrideTransport(UPSTREAM_OVERRIDE, http2=HTTP2, limits=limits)
+    else:
+        transport = httpx.AsyncHTTPTransport(http2=HTTP2, limits=limits)
+    return httpx.AsyncClient(
+        follow_redirects=True,
+        timeout=httpx.Timeout(settings['timeout'], connect=min(10, settings['timeout'])),
+        transport=TracingTransport(upstream, transport)
+    )
+
+
+# Shared client with its own connection pool for each upstream
+def get_client(upstream: str) -> httpx.AsyncClient:
+    client = clients.get(upstream)
+    if client is None or client.is_closed:
+        client = create_client(upstream)
+        clients[upstream] = client
+    return client
+
+
+async def open_clients() -> None:
+    for upstream in UPSTREAMS:
+        get_client(upstream)
+
+
+async def close_clients() -> None:
+    for client in clients.values():
+        await client.aclose()
+    clients.clear()
@@ -0,0 +1,132 @@
+from email.utils import parsedate_to_datetime
+import asyncio
+import random
+import time
+
+INITIAL_RATE = 50
+MIN_RATE = 1
+MAX_RATE = 100
+MAX_CONCURRENCY = 50
+DECREASE_FACTOR = 0.5
+DECREASE_INTERVAL = 1
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8
+
+
+class AdaptiveLimiter():
+    """
+    Token bucket with an AIMD rate: every success adds a little rate, every
+    rate limited response halves it. Retry-After and rate limit headers pause
+    all requests of the limiter until the reset time.
+    """
+
+    def __init__(self, rate: float = INITIAL_RATE, min_rate: float = MIN_RATE, max_rate: float = MAX_RATE, max_concurrency: int = MAX_CONCURRENCY):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.last_decrease = 0
+        self.in_flight = 0
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.requests = 0
+        self.throttled = 0
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    async def acquire(self) -> None:
+        # Reserve a token before awaiting, waiters get tokens in arrival order and sleep concurrently
+        now = time.monotonic()
+        self.refill(now)
+        self.tokens -= 1
+        delay = max(self.paused_until - now, 0) + max(-self.tokens / self.rate, 0)
+        while delay > 0:
+            await asyncio.sleep(delay)
+            # Paused while waiting
+            delay = self.paused_until - time.monotonic()
+
+        await self.slots.acquire()
+        self.in_flight += 1
+        self.requests += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self.slots.release()
+
+    def refill(self, now: float) -> None:
+        # No tokens are added during a pause
+        self.tokens = min(self.rate, self.tokens + max(now - self.updated, 0) * self.rate)
+        self.updated = max(self.updated, now)
+
+    def update(self, status_code: int, headers) -> None:
+        now = time.monotonic()
+
+        if status_code == 429:
+            self.throttled += 1
+            # Concurrent 429 of the same burst count once
+            if now - self.last_decrease > DECREASE_INTERVAL:
+                self.refill(now)
+                self.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+                self.tokens = min(self.tokens, 0)
+                self.last_decrease = now
+            self.pause(now + (retry_after(headers) or 0))
+        elif status_code < 400:
+            self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+
+        # Explicit quota exhausted
+        if headers.get('x-ratelimit-remaining') == '0':
+            reset = parse_seconds(headers.get('x-ratelimit-reset'))
+            if reset != None:
+                # Reset as epoch time or as seconds from now
+                self.pause(now + (reset - time.time() if reset > 1e9 else reset))
+
+    def pause(self, until: float) -> None:
+        self.refill(time.monotonic())
+        self.paused_until = max(self.paused_until, until)
+        self.updated = max(self.updated, until)
+
+    def retry_delay(self, attempt: int) -> float:
+        # Full jitter exponential backoff
+        return random.uniform(0, min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX))
+
+    def available(self) -> int:
+        now = time.monotonic()
+        if now < self.paused_until:
+            return 0
+        tokens = min(self.rate, self.tokens + max(now - self.updated, 0) * self.rate)
+        return int(min(tokens, self.max_concurrency - self.in_flight))
+
+    def stats(self) -> dict:
+        return {
+            "rate": round(self.rate, 2),
+            "in_flight": self.in_flight,
+            "paused": time.monotonic() < self.paused_until,
+            "requests": self.requests,
+            "throttled": self.throttled
+        }
+
+
+# Retry-After as seconds or HTTP date
+def retry_after(headers) -> float | None:
+    value = headers.get('retry-after')
+    seconds = parse_seconds(value)
+    if seconds != None or not value:
+        return seconds
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_seconds(value) -> float | None:
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        return None
@@ -1,8 +1,16 @@
-from cache import Cache
+from cache import Cache, MemoryCache
 from datetime import timedelta
 from collections import defaultdict
+from api import http_client
+from api.rate_limiter import AdaptiveLimiter
+from background import WorkerPool
+import ttl_policy
 import httpx
+import tracing
+import functools
+import copy
 import os
+import time
 import asyncio
 import json
 
@@ -13,7 +21,24 @@ TMDB_POSTER_URL = 'https://image.tmdb.org/t/p/w500'
 TMDB_BACK_URL = 'https://image.tmdb.org/t/p/original'
 TMDB_API_KEY = os.getenv('TMDB_API_KEY')
 
-TMDB_SEMAPHORES = defaultdict(lambda: asyncio.Semaphore(50))
+# Shared by all requests of an API key
+TMDB_LIMITERS = defaultdict(AdaptiveLimiter)
+
+# Timed out or failed connections are retried less than rate limits, each can take the full timeout
+MAX_TRANSPORT_RETRIES = 2
+
+# Seasons fetched with append_to_response (TMDB limit is 20 per request)
+SEASONS_PER_REQUEST = 20
+EPISODE_FIELDS = ('name', 'season_number', 'air_date', 'vote_average', 'overview', 'still_path')
+
+# Optional warm-up of the /find results and metas of other languages from a single translations request ('all' or a list like 'it-IT,de-DE')
+WARM_LANGUAGES = os.getenv('TMDB_WARM_LANGUAGES', '')
+WARM_WORKERS = 2
+WARM_QUEUE_SIZE = 500
+WARM_RATE = 5
+WARM_TMDB_RESERVE = 25
+WARM_TRANSLATIONS_SIZE = 1024
+WARM_TRANSLATIONS_TTL = 3600
 
 # Load languages
 with open("languages/languages.json", "r", encoding="utf-8") as f:
@@ -25,41 +50,75 @@ for language in LANGUAGES:
     tmp_cache[language] = Cache(f"./cache/{language}/tmdb/tmp", timedelta(days=7).total_seconds())
     #tmp_cache[language].clear()
 
+# Language warm-ups, rate limited
+warm_pool = WorkerPool(WARM_WORKERS, WARM_QUEUE_SIZE, 1 / WARM_RATE)
+# Translations shared by the /find and meta warm-ups of a title
+warm_translations_cache = MemoryCache(WARM_TRANSLATIONS_SIZE)
+
+
+# Requests a TMDB key can send right now
+def available_requests(api_key: str) -> int:
+    return TMDB_LIMITERS[api_key].available()
+
 
 # Too many requests retry
-async def fetch_and_retry(client: httpx.AsyncClient, id: str, url: str, language: str, params={}, max_retries=10) -> dict:
+async def fetch_and_retry(id: str, url: str, language: str, params={}, max_retries=10) -> dict:
     headers = {
         "accept": "application/json"
     }
+    client = http_client.get_client('tmdb')
     tmdb_api_key = params.get('api_key', None)
-    semaphore = TMDB_SEMAPHORES[tmdb_api_key]
-    async with semaphore:
-        for attempt in range(1, max_retries + 1):
-            response = await client.get(url, headers=headers, params=params)
+    limiter = TMDB_LIMITERS[tmdb_api_key]
+    response, transport_errors = None, 0
+    for attempt in range(1, max_retries + 1):
+        queued = time.perf_counter()
+        try:
+            async with limiter:
+                tracing.record_wait('tmdb', time.perf_counter() - queued)
+                response = await client.get(url, headers=headers, params=params)
+        # Timeouts and connection errors, retried a few times with backoff
+        except httpx.TransportError as e:
+            print(f"TMDB transport error: {e!r}")
+            response = None
+            transport_errors += 1
+            if transport_errors > MAX_TRANSPORT_RETRIES:
+                break
+            tracing.record_retry('tmdb')
+            await asyncio.sleep(limiter.retry_delay(attempt))
+            continue
+        limiter.update(response.status_code, response.headers)
 
-            if response.status_code == 200:
-                meta_dict = response.json()
+        if response.status_code == 200:
+            meta_dict = response.json()
 
-                # Only imdb_id cache save
-                if 'tt' in str(id):
-                    meta_dict['imdb_id'] = id
-                    tmp_cache[language].set(id, meta_dict)
+            # Only imdb_id cache save
+            if 'tt' in str(id):
+                meta_dict['imdb_id'] = id
+                tmp_cache[language].set(id, meta_dict, ttl_policy.tmdb_ttl(meta_dict))
 
-                return meta_dict
+            return meta_dict
 
-            elif response.status_code == 429:
-                print(response)
-                await asyncio.sleep(1)#(attempt * 2)
+        elif response.status_code == 401:
+            return {"error": "tmdb-key-error"}
 
-            elif response.status_code == 401:
-                return {"error": "tmdb-key-error"}
+        # Not found and other client errors will not change on retry
+        elif 400 <= response.status_code < 500 and response.status_code != 429:
+            break
+
+        # Wait without holding a request slot, the limiter applies Retry-After
+        if response.status_code == 429:
+            print(response)
+        tracing.record_retry('tmdb')
+        await asyncio.sleep(limiter.retry_delay(attempt))
 
     print('TMDB failed fetch')
+    if response == None or response.status_code >= 500 or response.status_code == 429:
+        ttl_policy.mark_degraded()
     return {}
 
 
 # Get from external source id
-async def get_tmdb_data(client: httpx.AsyncClient, id: str, source: str, language: str, api_key: str) -> dict:
+async def get_tmdb_data(id: str, source: str, language: str, api_key: str) -> dict:
     params = {
         "external_source": source,
         "language": language,
@@ -67,60 +126,163 @@ async def get_tmdb_data(client: httpx.AsyncClient, id: str, source: str, languag
     }
 
     url = f"https://api.themoviedb.org/3/find/{id}"
-    item = tmp_cache[language].get(id)
+    item = await tmp_cache[language].aget(id)
 
     if item != None:
+        # Failed lookup from the negative cache
+        if len(item) == 0:
+            ttl_policy.mark_degraded()
         return item
-    else:
-        return await fetch_and_retry(client, id, url, language, params)
+
+    item = await fetch_and_retry(id, url, language, params)
+    # Failed lookup, skip it until the negative TTL
+    if len(item) == 0:
+        tmp_cache[language].set(id, item, ttl_policy.NEGATIVE_TTL)
+    elif WARM_LANGUAGES and source == 'imdb_id' and not item.get('error'):
+        warm_pool.submit(('warm', id), functools.partial(warm_translations, id, item, language, api_key))
+    return item
+
+
+def warm_language_list() -> list[str]:
+    if WARM_LANGUAGES == 'all':
+        return list(LANGUAGES)
+    return [language.strip() for language in WARM_LANGUAGES.split(',') if language.strip() in LANGUAGES]
+
+
+async def warm_translations(imdb_id: str, find_data: dict, language: str, api_key: str) -> None:
+    """
+    Find results of the other languages built from one TMDB translations request:
+    the localized title and overview over the result of the first language.
+    Languages without a full translation are left to their own lookup.
+    """
+    result_key = next((key for key in ('movie_results', 'tv_results') if find_data.get(key)), None)
+    if result_key == None or available_requests(api_key) < WARM_TMDB_RESERVE:
+        return
+
+    missing = [other for other in warm_language_list() if other != language and await tmp_cache[other].aget(imdb_id) == None]
+    if not missing:
+        return
+
+    type, title_key = ('movie', 'title') if result_key == 'movie_results' else ('series', 'name')
+    translations = await get_translations(type, find_data[result_key][0]['id'], language, api_key)
+    for other in missing:
+        if other not in translations:
+            continue
+        warm_data = copy.deepcopy(find_data)
+        warm_data[result_key][0][title_key] = translations[other]['name']
+        warm_data[result_key][0]['overview'] = translations[other]['description']
+        tmp_cache[other].set(imdb_id, warm_data, ttl_policy.tmdb_ttl(warm_data))
+
+
+# Localized title and overview of every language with a full translation, from a single request
+async def get_translations(type: str, tmdb_id, language: str, api_key: str) -> dict:
+    key = (type, str(tmdb_id))
+    translations = warm_translations_cache.get(key)
+    if translations != None:
+        return translations
+
+    media_type, title_key = ('movie', 'title') if type == 'movie' else ('tv', 'name')
+    data = await fetch_and_retry(tmdb_id, f"https://api.themoviedb.org/3/{media_type}/{tmdb_id}/translations", language, { "api_key": api_key })
+
+    translations = {}
+    for item in data.get('translations', []):
+        translation = item.get('data', {})
+        if translation.get(title_key) and translation.get('overview'):
+            translations[f"{item['iso_639_1']}-{item['iso_3166_1']}"] = { "name": translation[title_key], "description": translation['overview'] }
+    if data:
+        warm_translations_cache.set(key, translations, time.time() + WARM_TRANSLATIONS_TTL)
+    return translations
     
 
-# Get movie detail with cast video and images
-async def get_movie_details(client: httpx.AsyncClient, id: str, language: str, api_key: str) -> dict:
+# Get movie detail with cast video and images, cast only when not shared by another language
+async def get_movie_details(id: str, language: str, api_key: str, with_neutral: bool = True) -> dict:
     params = {
         "api_key": api_key,
         "language": language,
-        "append_to_response": "credits,videos,images",
+        "append_to_response": "credits,videos,images" if with_neutral else "videos,images",
         "include_image_language": f"{language},null"
     }
     url = f"https://api.themoviedb.org/3/movie/{id}"
-    return await fetch_and_retry(client, id, url, language, params=params)
+    return await fetch_and_retry(id, url, language, params=params)
 
 
-# Get series detail with cast video and images
-async def get_series_details(client: httpx.AsyncClient, id: str, language: str, api_key: str) -> dict:
+# Get series detail with cast video and images, cast and external ids only when not shared by another language
+async def get_series_details(id: str, language: str, api_key: str, with_neutral: bool = True) -> dict:
     params = {
         "api_key": api_key,
         "language": language,
-        "append_to_response": "external_ids,credits,videos,images",
+        "append_to_response": "external_ids,credits,videos,images" if with_neutral else "videos,images",
         "include_image_language": f"{language},null"
     }
     url = f"https://api.themoviedb.org/3/tv/{id}"
-    return await fetch_and_retry(client, id, url, language, params=params)
+    return await fetch_and_retry(id, url, language, params=params)
 
 
-# Get series detail with cast video and images
-async def get_season_details(client: httpx.AsyncClient, season_id: str, season_number, language: str, api_key: str) -> dict:
-    params = {
-        "language": language,
-        "append_to_response": "external_ids",
-        "api_key": api_key
+# Seasons details with episodes, each season is cached on its own, refresh seasons are fetched even when cached
+async def get_seasons_details(series_data: dict, language: str, api_key: str, season_numbers: list[int] = None, refresh: list[int] = ()) -> list[dict]:
+    series_id = series_data['id']
+    if season_numbers == None:
+        season_numbers = [season['season_number'] for season in series_data.get('seasons', [])]
+    seasons = {}
+    missing = []
+
+    for season_number in season_numbers:
+        cached = await tmp_cache[language].aget(season_cache_key(series_id, season_number))
+        if cached != None:
+            seasons[season_number] = cached
+        if cached == None or season_number in refresh:
+            missing.append(season_number)
+
+    tasks = []
+    chunks = [missing[i:i + SEASONS_PER_REQUEST] for i in range(0, len(missing), SEASONS_PER_REQUEST)]
+    for chunk in chunks:
+        params = {
+            "language": language,
+            "append_to_response": ','.join(f"season/{season_number}" for season_number in chunk),
+            "api_key": api_key
+        }
+        tasks.append(fetch_and_retry(series_id, f"https://api.themoviedb.org/3/tv/{series_id}", language, params))
+
+    fetched = set()
+    for chunk, data in zip(chunks, await asyncio.gather(*tasks)):
+        for season_number in chunk:
+            season = data.get(f"season/{season_number}")
+            if season:
+                season = trim_season(season)
+                seasons[season_number] = season
+                fetched.add(season_number)
+                tmp_cache[language].set(season_cache_key(series_id, season_number), season, ttl_policy.season_ttl(season_number, series_data))
+
+    # Failed seasons are left empty or kept from the cache, the meta is cached as degraded and fetched again soon
+    if len(fetched) < len(missing):
+        ttl_policy.mark_degraded()
+    return [seasons.get(season_number, { "season_number": season_number, "episodes": [] }) for season_number in season_numbers]
+
+
+# Only the episode fields used by the meta are cached (no crew and guest stars)
+def trim_season(season: dict) -> dict:
+    return {
+        "season_number": season.get('season_number'),
+        "episodes": [{ field: episode.get(field) for field in EPISODE_FIELDS } for episode in season.get('episodes', [])]
     }
 
-    url = f"https://api.themoviedb.org/3/tv/{season_id}/season/{season_number}"
-    return await fetch_and_retry(client, season_id, url, language, params)
+
+def season_cache_key(series_id, season_number) -> str:
+    return f"tv:{series_id}:season:{season_number}"
+
 
 # Converting imdb id to tmdb id
 async def convert_imdb_to_tmdb(imdb_id: str, language: str, api_key: str) -> str:
 
-    tmdb_data = tmp_cache[language].get(imdb_id)
+    tmdb_data = await tmp_cache[language].aget(imdb_id)
 
     if tmdb_data != None:
+        if len(tmdb_data) == 0:
+            ttl_policy.mark_degraded()
         return get_id(tmdb_data)
     else:
-        async with httpx.AsyncClient(timeout=20) as client:
-            tmdb_data = await get_tmdb_data(client, imdb_id, 'imdb_id', language, api_key)
-            return get_id(tmdb_data)
+        tmdb_data = await get_tmdb_data(imdb_id, 'imdb_id', language, api_key)
+        return get_id(tmdb_data)
         
 
 # Search and parse id
@@ -0,0 +1,215 @@
+from api import http_client
+import translation_batcher
+import urllib.parse
+import abc
+import asyncio
+import time
+import os
+
+# Comma separated list of kind=url (kind: lingva, libre)
+DEFAULT_PROVIDERS = 'lingva=https://lingva-translate-azure.vercel.app,lingva=https://lingva.ml,lingva=https://lingva.lunar.icu'
+TRANSLATION_PROVIDERS = os.getenv('TRANSLATION_PROVIDERS', DEFAULT_PROVIDERS)
+LIBRETRANSLATE_API_KEY = os.getenv('LIBRETRANSLATE_API_KEY')
+
+PROVIDER_TIMEOUT = 10
+HEDGE_MIN_DELAY = 0.3
+HEDGE_MAX_DELAY = 2
+LATENCY_DECAY = 0.2
+FAILURES_TO_OPEN = 3
+CIRCUIT_COOLDOWN = 30
+MAX_CIRCUIT_COOLDOWN = 600
+
+
+class TranslationProvider(abc.ABC):
+    """
+    Translation backend with latency and error tracking.
+    translate_batch returns a translation (or None) for every text.
+    """
+
+    kind = None
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.latency = None
+        self.calls = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.open_until = 0
+        self.cooldown = CIRCUIT_COOLDOWN
+        # Opened and not closed by a success yet, half open after the cooldown
+        self.tripped = False
+        self.probing = False
+
+    @abc.abstractmethod
+    async def translate_batch(self, texts: list[str], source: str, target: str) -> list[str | None]:
+        ...
+
+    def is_available(self) -> bool:
+        # Half open after the cooldown, a single probe at a time until a success closes the circuit
+        return time.monotonic() >= self.open_until and not self.probing
+
+    def record_success(self, elapsed: float) -> None:
+        self.calls += 1
+        self.consecutive_failures = 0
+        self.cooldown = CIRCUIT_COOLDOWN
+        self.tripped = False
+        self.observe_latency(elapsed)
+
+    def observe_latency(self, elapsed: float) -> None:
+        self.latency = elapsed if self.latency is None else (1 - LATENCY_DECAY) * self.latency + LATENCY_DECAY * elapsed
+
+    def record_failure(self) -> None:
+        self.calls += 1
+        self.errors += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= FAILURES_TO_OPEN:
+            self.open_until = time.monotonic() + self.cooldown
+            self.cooldown = min(self.cooldown * 2, MAX_CIRCUIT_COOLDOWN)
+            self.tripped = True
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "calls": self.calls,
+            "errors": self.errors,
+            "latency_ms": round(self.latency * 1000) if self.latency is not None else None,
+            "circuit_open": not self.is_available()
+        }
+
+
+class LingvaProvider(TranslationProvider):
+
+    kind = 'lingva'
+
+    async def translate(self, text: str, source: str, target: str) -> str | None:
+        api_url = f"{self.url}/api/v1/{source}/{target}/{urllib.parse.quote(text, safe='')}"
+        response = await http_client.get_client('translator').get(api_url)
+        response.raise_for_status()
+        return response.json().get('translation')
+
+    # Lingva has no batch endpoint, texts are joined with a separator
+    async def translate_batch(self, texts: list[str], source: str, target: str) -> list[str | None]:
+        if len(texts) == 1:
+            return [await self.translate(texts[0], source, target)]
+
+        translated = await self.translate(translation_batcher.join_batch(texts), source, target)
+        parts = translation_batcher.split_batch(translated, len(texts)) if translated else None
+
+        # Separator lost in translation, fallback to single requests
+        if parts == None:
+            return await asyncio.gather(*[self.translate(text, source, target) for text in texts])
+        return parts
+
+
+class LibreTranslateProvider(TranslationProvider):
+
+    kind = 'libre'
+
+    # Native batch support with a list of texts
+    async def translate_batch(self, texts: list[str], source: str, target: str) -> list[str | None]:
+        payload = {
+            "q": texts,
+            "source": source,
+            "target": target,
+            "format": "text"
+        }
+        if LIBRETRANSLATE_API_KEY:
+            payload['api_key'] = LIBRETRANSLATE_API_KEY
+
+        response = await http_client.get_client('translator').post(f"{self.url}/translate", json=payload)
+        response.raise_for_status()
+        translated = response.json().get('translatedText', [])
+        if len(translated) != len(texts):
+            raise ValueError(f"LibreTranslate returned {len(translated)} translations for {len(texts)} texts")
+        return translated
+
+
+PROVIDER_KINDS = { provider.kind: provider for provider in [LingvaProvider, LibreTranslateProvider] }
+
+
+class ProviderPool():
+    """
+    Route every batch to the fastest healthy provider and hedge it on the
+    next one when the answer is slower than expected.
+    """
+
+    def __init__(self, providers: list[TranslationProvider]):
+        self.providers = providers
+        self.hedged = 0
+
+    def ranked(self) -> list[TranslationProvider]:
+        available = [provider for provider in self.providers if provider.is_available()]
+        # Never measured providers first, they need a latency sample
+        return sorted(available, key=lambda provider: -1 if provider.latency is None else provider.latency)
+
+    async def translate_batch(self, texts: list[str], source: str, target: str) -> list[str | None]:
+        candidates = self.ranked()
+        running = set()
+
+        while candidates or running:
+            if candidates:
+                provider = candidates.pop(0)
+                running.add(asyncio.ensure_future(self.call(provider, texts, source, target)))
+                if len(running) > 1:
+                    self.hedged += 1
+                delay = hedge_delay(provider) if candidates else None
+            else:
+                delay = None
+
+            done, running = await asyncio.wait(running, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if result is not None:
+                    for other in running:
+                        other.cancel()
+                    return result
+
+        return [None] * len(texts)
+
+    async def call(self, provider: TranslationProvider, texts: list[str], source: str, target: str) -> list[str | None] | None:
+        # Half open, other callers are rejected while the probe runs
+        probe = provider.tripped
+        if probe:
+            if provider.probing:
+                return None
+            provider.probing = True
+
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(provider.translate_batch(texts, source, target), PROVIDER_TIMEOUT)
+        except asyncio.CancelledError:
+            # Lost the hedge, still a lower bound of its latency
+            provider.observe_latency(time.monotonic() - start)
+            raise
+        except Exception as e:
+            print(f"Translation provider {provider.url} error: {e!r}")
+            provider.record_failure()
+            return None
+        finally:
+            if probe:
+                provider.probing = False
+
+        provider.record_success(time.monotonic() - start)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "hedged": self.hedged,
+            "providers": [provider.stats() for provider in self.providers]
+        }
+
+
+def hedge_delay(provider: TranslationProvider) -> float:
+    if provider.latency is None:
+        return HEDGE_MAX_DELAY
+    return min(max(provider.latency * 2, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+
+def load_providers(config: str = TRANSLATION_PROVIDERS) -> ProviderPool:
+    providers = []
+    for item in config.split(','):
+        if not item.strip():
+            continue
+        kind, url = item.strip().split('=', 1)
+        providers.append(PROVIDER_KINDS[kind](url))
+    return ProviderPool(providers)
@@ -1,7 +1,8 @@
-from cache import Cache
 from datetime import timedelta
-import httpx
+from api import http_client
+import tracing
 import asyncio
+import time
 import os
 import json
 
@@ -21,74 +22,113 @@ with open("languages/lang_tvdb.json", "r", encoding="utf-8") as f:
     LANGUAGE_MAP = json.load(f) 
 
 
-# Cache set
-#token_cache = Cache(maxsize=1, ttl=timedelta(days=29).total_seconds())
-token_cache = Cache('./cache/tvdb/token', timedelta(days=29).total_seconds())
-token_cache.clear()
+# Bearer token (TVDB tokens are valid for one month)
+TOKEN_EXPIRES = timedelta(days=29).total_seconds()
+# Failed logins (revoked key, TVDB outage) are not retried before this delay
+LOGIN_RETRY_INTERVAL = timedelta(minutes=1).total_seconds()
+token = None
+token_expires_at = 0
+login_retry_at = 0
+token_lock = asyncio.Lock()
+
+
+# Token manager, a single login is shared by concurrent callers
+async def get_token(expired_token: str = None) -> str:
+    global token, token_expires_at, login_retry_at
+    if token and token != expired_token and time.monotonic() < token_expires_at:
+        return token
+    if time.monotonic() < login_retry_at:
+        return ''
+
+    async with token_lock:
+        # Refreshed or failed by another caller while waiting
+        if token and token != expired_token and time.monotonic() < token_expires_at:
+            return token
+        if time.monotonic() < login_retry_at:
+            return ''
+
+        new_token = await tvdb_login()
+        if new_token:
+            token = new_token
+            token_expires_at = time.monotonic() + TOKEN_EXPIRES
+        else:
+            login_retry_at = time.monotonic() + LOGIN_RETRY_INTERVAL
+        return new_token
+
 
 # Too many requests retry
-async def fetch_and_retry(client: httpx.AsyncClient, url: str, token='', type='GET', params={}, max_retries=10, payload={}) -> dict:
-    headers = {
-        "accept": "application/json",
-        "Authorization": f"Bearer {token}" if type == 'GET' else ''
-    }
+async def fetch_and_retry(url: str, type='GET', params={}, max_retries=10, payload={}) -> dict:
+    client = http_client.get_client('tvdb')
+    token = await get_token() if type == 'GET' else ''
+    if type == 'GET' and not token:
+        return {}
+    relogged = False
 
     for attempt in range(1, max_retries + 1):
+        headers = {
+            "accept": "application/json",
+            "Authorization": f"Bearer {token}" if type == 'GET' else ''
+        }
+
         if type == 'GET':
             response = await client.get(url, headers=headers, params=params)
         elif type == 'POST':
             response = await client.post(url, headers=headers, json=payload, params=params)
 
         if response.status_code == 200:
-            data = response.json()
-            # Cache token
-            if type == 'POST':
-                token_cache.set('token', data['data']['token'])
-            return data
+            return response.json()
+
+        # Expired or revoked token, a single new login per call
+        elif response.status_code == 401 and type == 'GET' and not relogged:
+            tracing.record_retry('tvdb')
+            relogged = True
+            token = await get_token(expired_token=token)
+            if not token:
+                break
+
+        # Other client errors (and a rejected new token) will not change on retry
+        elif 400 <= response.status_code < 500 and response.status_code != 429:
+            print(response)
+            break
 
         else:
             print(response)
+            tracing.record_retry('tvdb')
             await asyncio.sleep(attempt * 2)
 
     return {}
 
 
 # Login to get token
-async def tvdb_login(client: httpx.AsyncClient) -> str:
+async def tvdb_login() -> str:
     payload = {
         "apikey": TVDB_API_KEY,
         "pin": None,
         "user": None
     }
-    async with httpx.AsyncClient() as client:
-        resp = await fetch_and_retry(client, f"{BASE_URL}/login", '', type='POST', payload=payload)
-        token = resp['data']['token']
-        token_cache.set('token', token)
-        return token
+    resp = await fetch_and_retry(f"{BASE_URL}/login", type='POST', payload=payload, max_retries=3)
+    return resp.get('data', {}).get('token', '')
 
 
 # Season detail with episodes
-async def get_season_details(client: httpx.AsyncClient, season_id: int):
-    token = token_cache.get('token', await tvdb_login(client))
-    data = await fetch_and_retry(client, f"{BASE_URL}/seasons/{season_id}/extended", token=token, type='GET')
+async def get_season_details(season_id: int):
+    data = await fetch_and_retry(f"{BASE_URL}/seasons/{season_id}/extended", type='GET')
     return data
 
 # Series detail with episodes
-async def get_translated_episodes(client: httpx.AsyncClient, series_id: int, page: int, language: str):
+async def get_translated_episodes(series_id: int, page: int, language: str):
     params = {
         "page": page
     }
-    token = token_cache.get('token', await tvdb_login(client))
-    data = await fetch_and_retry(client, f"{BASE_URL}/series/{series_id}/episodes/official/{LANGUAGE_MAP[language]}", token=token, type='GET', params=params)
+    data = await fetch_and_retry(f"{BASE_URL}/series/{series_id}/episodes/official/{LANGUAGE_MAP[language]}", type='GET', params=params)
     return data
 
 
 # Seson detail with episodes
-async def get_series_details(client: httpx.AsyncClient, series_id: int):
+async def get_series_details(series_id: int):
     params = {
         "meta": "episodes",
         "short": True
     }
-    token = token_cache.get('token', await tvdb_login(client))
-    data = await fetch_and_retry(client, f"{BASE_URL}/series/{series_id}/extended", token=token, type='GET', params=params)
+    data = await fetch_and_retry(f"{BASE_URL}/series/{series_id}/extended", type='GET', params=params)
     return data
\ No newline at end of file
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+
+class WorkerPool():
+    """
+    Bounded queue of background jobs run by a fixed number of workers.
+    Jobs are deduplicated by key while queued or running, an interval
+    limits the rate of started jobs.
+    """
+
+    def __init__(self, workers: int = 4, maxsize: int = 1000, interval: float = 0):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.interval = interval
+        self.next_start = 0
+        self.queue = None
+        self.tasks = []
+        self.pending = set()
+        self.submitted = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        self.queue = asyncio.Queue(self.maxsize)
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.queue = None
+        self.pending.clear()
+
+    def submit(self, key, fn) -> bool:
+        if self.queue is None or key in self.pending:
+            return False
+        try:
+            self.queue.put_nowait((key, fn))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+        self.pending.add(key)
+        self.submitted += 1
+        return True
+
+    async def worker(self) -> None:
+        while True:
+            key, fn = await self.queue.get()
+            try:
+                await self.throttle()
+                await fn()
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Background job {key} error: {e!r}")
+            finally:
+                self.pending.discard(key)
+                self.queue.task_done()
+
+    async def throttle(self) -> None:
+        if not self.interval:
+            return
+        now = time.monotonic()
+        start = max(now, self.next_start)
+        self.next_start = start + self.interval
+        await asyncio.sleep(start - now)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "pending": len(self.pending),
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "completed": self.completed,
+            "failed": self.failed
+        }
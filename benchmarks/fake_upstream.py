@@ -0,0 +1,268 @@
+"""
+Local stand-in for every upstream of the addon (TMDB, TVDB, fanart, Cinemeta,
+Kitsu addon, lingva, GitHub anime lists and a catalog addon).
+Responses are generated from the requested ids and dispatched on the Host header,
+the app reaches it through UPSTREAM_OVERRIDE.
+
+    python benchmarks/fake_upstream.py --port 9100 --latency 0.05 --error-rate 0.01
+"""
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from collections import Counter
+import urllib.parse
+import argparse
+import asyncio
+import random
+import json
+import os
+import re
+
+# Generated ids, anime kitsu ids are mapped two by two on the same imdb id
+MOVIE_BASE = 1000000
+SERIES_BASE = 9000000
+ANIME_BASE = 7000000
+ANIME_COUNT = 200
+CATALOG_PAGE = 20
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+settings = {
+    "latency": 0.0,
+    "jitter": 0.0,
+    "error_rate": 0.0,
+    "throttle_rate": 0.0
+}
+calls = Counter()
+
+
+def imdb_number(imdb_id: str) -> int:
+    return int(imdb_id[2:])
+
+
+def anime_imdb(kitsu_id: int) -> str:
+    return f"tt{ANIME_BASE + (kitsu_id + 1) // 2:07d}"
+
+
+# TMDB
+def tmdb_find(id: str, params: dict) -> dict:
+    result = { "movie_results": [], "tv_results": [], "tv_episode_results": [] }
+    if params.get('external_source') == 'tvdb_id':
+        result['tv_episode_results'].append({ "name": f"Episode {id}", "overview": f"Overview {id}", "still_path": "/still.jpg" })
+    elif id.startswith('tt1'):
+        number = imdb_number(id) - MOVIE_BASE
+        result['movie_results'].append({ "id": number, "title": f"Movie {number}", "overview": f"Movie overview {number}", "poster_path": "/poster.jpg", "backdrop_path": "/backdrop.jpg", "release_date": "2015-06-01" })
+    elif id.startswith('tt9') or id.startswith('tt7'):
+        number = imdb_number(id)
+        result['tv_results'].append({ "id": number, "name": f"Series {number}", "overview": f"Series overview {number}", "poster_path": "/poster.jpg", "backdrop_path": "/backdrop.jpg", "first_air_date": "2012-01-01" })
+    return result
+
+
+def tmdb_credits() -> dict:
+    return {
+        "cast": [{ "name": f"Actor {i}", "known_for_department": "Acting" } for i in range(10)],
+        "crew": [{ "name": "Director", "department": "Directing", "known_for_department": "Directing", "job": "Director" }, { "name": "Writer", "department": "Writing", "known_for_department": "Writing", "job": "Writer" }]
+    }
+
+
+def tmdb_movie(id: int) -> dict:
+    return {
+        "id": id, "imdb_id": f"tt{MOVIE_BASE + id:07d}", "title": f"Movie {id}", "overview": f"Movie overview {id}",
+        "release_date": "2015-06-01", "runtime": 110, "status": "Released", "poster_path": "/poster.jpg", "backdrop_path": "/backdrop.jpg",
+        "genres": [{ "id": 18, "name": "Drama" }], "credits": tmdb_credits(), "videos": { "results": [] }, "images": { "logos": [] }
+    }
+
+
+def season_count(id: int) -> int:
+    return 1 + id % 5
+
+
+def tmdb_episodes(id: int, season: int) -> list:
+    return [{
+        "name": f"Episode {season}x{number}", "overview": f"Overview {season}x{number}", "season_number": season, "episode_number": number,
+        "air_date": "2015-01-01", "vote_average": 7.5, "still_path": "/still.jpg"
+    } for number in range(1, 11 + (id + season) % 14)]
+
+
+def tmdb_tv(id: int, params: dict) -> dict:
+    seasons = season_count(id)
+    data = {
+        "id": id, "name": f"Series {id}", "overview": f"Series overview {id}", "first_air_date": "2012-01-01", "last_air_date": "2020-01-01",
+        "status": "Ended", "poster_path": "/poster.jpg", "backdrop_path": "/backdrop.jpg", "episode_run_time": [45],
+        "seasons": [{ "season_number": n, "episode_count": len(tmdb_episodes(id, n)), "air_date": "2012-01-01" } for n in range(1, seasons + 1)],
+        "number_of_episodes": sum(len(tmdb_episodes(id, n)) for n in range(1, seasons + 1)),
+        "last_episode_to_air": { "season_number": seasons, "episode_number": 10, "air_date": "2020-01-01", "runtime": 45 },
+        "next_episode_to_air": None, "external_ids": { "tvdb_id": id }, "genres": [{ "id": 18, "name": "Drama" }],
+        "credits": tmdb_credits(), "videos": { "results": [] }, "images": { "logos": [] }
+    }
+    for part in params.get('append_to_response', '').split(','):
+        if part.startswith('season/'):
+            season = int(part.split('/')[1])
+            data[part] = { "season_number": season, "air_date": "2012-01-01", "episodes": tmdb_episodes(id, season) }
+    return data
+
+
+# Full translations for a few languages, fr-FR without overview
+def tmdb_translations(media_type: str, id: int) -> dict:
+    title_key = 'title' if media_type == 'movie' else 'name'
+    translations = []
+    for language in ('it-IT', 'de-DE', 'es-ES', 'fr-FR'):
+        iso_639_1, iso_3166_1 = language.split('-')
+        translations.append({ "iso_639_1": iso_639_1, "iso_3166_1": iso_3166_1, "data": {
+            title_key: f"{language} {id}", "overview": '' if language == 'fr-FR' else f"{language} overview {id}"
+        } })
+    return { "id": id, "translations": translations }
+
+
+def tmdb(path: str, params: dict):
+    match = re.fullmatch(r'/3/find/(.+)', path)
+    if match:
+        return tmdb_find(match.group(1), params)
+    match = re.fullmatch(r'/3/(movie|tv)/(\d+)/translations', path)
+    if match:
+        return tmdb_translations(match.group(1), int(match.group(2)))
+    match = re.fullmatch(r'/3/movie/(\d+)', path)
+    if match:
+        return tmdb_movie(int(match.group(1)))
+    match = re.fullmatch(r'/3/tv/(\d+)', path)
+    if match:
+        return tmdb_tv(int(match.group(1)), params)
+    match = re.fullmatch(r'/3/tv/(\d+)/season/(\d+)', path)
+    if match:
+        season = int(match.group(2))
+        return { "season_number": season, "episodes": tmdb_episodes(int(match.group(1)), season) }
+    return None
+
+
+# TVDB, anime episodes in absolute order with a few untranslated ones
+def tvdb(path: str, params: dict):
+    if path == '/v4/login':
+        return { "data": { "token": "bench-token" } }
+    match = re.fullmatch(r'/v4/series/(\d+)/episodes/official/(\w+)', path)
+    if match:
+        id = int(match.group(1))
+        count = 12 + id % 40 if int(params.get('page', 0)) == 0 else 0
+        return { "data": { "episodes": [{
+            "id": id * 1000 + number, "seasonNumber": 1, "number": number, "aired": "2015-01-01", "image": "/banners/episode.jpg",
+            "name": None if number % 7 == 0 else f"Episodio {number}", "overview": None if number % 7 == 0 else f"Trama {number}"
+        } for number in range(1, count + 1)] } }
+    return None
+
+
+def cinemeta(path: str):
+    match = re.fullmatch(r'/meta/(\w+)/(.+)\.json', path)
+    if not match:
+        return None
+    type, id = match.groups()
+    meta = { "id": id, "type": type, "name": f"Cinemeta {id}", "description": f"Cinemeta description {id}", "imdbRating": "7.1", "logo": "https://images.bench/logo.png", "runtime": "45 min" }
+    if type == 'series':
+        meta['videos'] = [{ "id": f"{id}:1:{number}", "season": 1, "episode": number, "name": f"Episode {number}", "tvdb_id": imdb_number(id) * 1000 + number } for number in range(1, 13)]
+    return { "meta": meta }
+
+
+def kitsu(path: str):
+    match = re.fullmatch(r'/meta/(\w+)/(.+)\.json', path)
+    if not match:
+        return None
+    type, id = match.group(1), urllib.parse.unquote(match.group(2))
+    kitsu_id = int(id.split(':')[1])
+    return { "meta": {
+        "id": id, "type": type, "name": f"Anime {kitsu_id}", "description": f"Anime description {kitsu_id}",
+        "imdb_id": anime_imdb(kitsu_id) if kitsu_id <= ANIME_COUNT else None, "animeType": "TV",
+        "videos": [{ "id": f"{id}:{number}", "season": 1, "episode": number, "title": f"Episode {number}", "overview": f"Overview {number}" } for number in range(1, 13)]
+    } }
+
+
+# Catalog addon, skip in the path selects the page
+def addon(path: str):
+    if path == '/manifest.json':
+        return {
+            "id": "bench.catalogs", "name": "Bench Catalogs", "description": "Benchmark catalogs", "resources": ["catalog"], "types": ["movie", "series", "anime"],
+            "catalogs": [{ "type": type, "id": "top", "name": f"Top {type}" } for type in ("movie", "series", "anime")]
+        }
+    match = re.fullmatch(r'/catalog/(\w+)/top(?:/skip=(\d+))?\.json', path)
+    if not match:
+        return None
+    type, skip = match.group(1), int(match.group(2) or 0)
+    if type == 'anime':
+        ids = range(skip + 1, skip + CATALOG_PAGE + 1)
+        return { "metas": [{ "id": f"kitsu:{id}", "type": "series", "animeType": "TV", "name": f"Anime {id}" } for id in ids] }
+    base = MOVIE_BASE if type == 'movie' else SERIES_BASE
+    return { "metas": [{ "id": f"tt{base + id:07d}", "type": type, "name": f"Title {id}", "poster": "https://images.bench/poster.jpg" } for id in range(skip + 1, skip + CATALOG_PAGE + 1)] }
+
+
+def lingva(path: str):
+    match = re.fullmatch(r'/api/v1/(\w+)/([\w-]+)/(.*)', path)
+    if not match:
+        return None
+    return { "translation": urllib.parse.unquote(match.group(3)).upper() }
+
+
+def github(path: str):
+    if path.endswith('anime-list-full.json'):
+        return [{ "kitsu_id": id, "mal_id": 100000 + id, "anidb_id": 500000 + id, "imdb_id": anime_imdb(id), "type": "TV" } for id in range(1, ANIME_COUNT + 1)]
+    if path.endswith('anime_ids.json'):
+        with open(os.path.join(ROOT, 'anime', 'anime_mapping_extension.json'), 'r', encoding='utf-8') as f:
+            extension = json.load(f)
+        seasons = { str(item['anidb_id']): { "tvdb_season": 1, "tvdb_epoffset": 0 } for item in extension if item.get('anidb_id') }
+        for id in range(1, ANIME_COUNT + 1):
+            seasons[str(500000 + id)] = { "tvdb_season": 1, "tvdb_epoffset": 0 if id % 2 else 12 }
+        return seasons
+    return None
+
+
+HOSTS = {
+    'api.themoviedb.org': lambda path, params: tmdb(path, params),
+    'api4.thetvdb.com': lambda path, params: tvdb(path, params),
+    'webservice.fanart.tv': lambda path, params: {},
+    'v3-cinemeta.strem.io': lambda path, params: cinemeta(path),
+    'anime-kitsu.strem.fun': lambda path, params: kitsu(path),
+    'addon.bench': lambda path, params: addon(path),
+    'raw.githubusercontent.com': lambda path, params: github(path)
+}
+
+
+async def handle(request: Request) -> Response:
+    path = request.url.path
+    if path == '/__bench/stats':
+        return JSONResponse(dict(calls))
+    if path == '/__bench/reset':
+        calls.clear()
+        return JSONResponse({})
+
+    host = request.headers.get('host', '').split(':')[0]
+    calls[host] += 1
+    if settings['latency'] or settings['jitter']:
+        await asyncio.sleep(settings['latency'] + random.uniform(0, settings['jitter']))
+
+    # Error injection, anime lists are always served
+    if host != 'raw.githubusercontent.com':
+        if host == 'api.themoviedb.org' and random.random() < settings['throttle_rate']:
+            return JSONResponse({ "status_code": 25 }, status_code=429, headers={ "Retry-After": "1" })
+        if random.random() < settings['error_rate']:
+            return JSONResponse({}, status_code=503)
+
+    handler = HOSTS.get(host, lambda path, params: lingva(path) if 'lingva' in host else None)
+    data = handler(path, dict(request.query_params))
+    if data == None:
+        return JSONResponse({}, status_code=404)
+    return JSONResponse(data)
+
+
+app = Starlette(routes=[Route('/{path:path}', handle, methods=['GET', 'POST'])])
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description='Fake upstream server for benchmarks')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra latency, up to seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of 503 responses')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of TMDB 429 responses')
+    args = parser.parse_args()
+
+    settings.update(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, throttle_rate=args.throttle_rate)
+    uvicorn.run(app, host='127.0.0.1', port=args.port, log_level='warning')
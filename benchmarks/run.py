@@ -0,0 +1,199 @@
+"""
+Benchmark of the addon routes against the fake upstream server.
+
+The app runs from a copy of the sources with an empty cache, every scenario is
+requested twice: cold (nothing cached) and warm (same requests again).
+
+    pip install uvicorn starlette httpx
+    python benchmarks/run.py --requests 200 --concurrency 20 --latency 0.05
+    python benchmarks/run.py --save-baseline       # store results for later commits
+    python benchmarks/run.py                       # compare with benchmarks/baseline.json
+"""
+from urllib.parse import quote
+import subprocess
+import statistics
+import argparse
+import tempfile
+import asyncio
+import base64
+import shutil
+import socket
+import httpx
+import time
+import json
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, 'benchmarks')
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+ADDON_URL = 'http://addon.bench'
+USER_SETTINGS = 'language=it-IT,tmdb_key=bench,rpdb=false'
+SCENARIOS = ['catalog', 'movie', 'series', 'anime']
+STARTUP_TIMEOUT = 60
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def scenario_paths(scenario: str, count: int) -> list[str]:
+    addon = base64.urlsafe_b64encode(ADDON_URL.encode()).decode().rstrip('=')
+    prefix = f"/{addon}/{USER_SETTINGS}"
+    if scenario == 'catalog':
+        types = ('movie', 'series', 'anime')
+        return [f"{prefix}/catalog/{types[i % 3]}/top/skip={(i // 3) * 20}.json" for i in range(count)]
+    if scenario == 'movie':
+        return [f"{prefix}/meta/movie/tt{1000001 + i:07d}.json" for i in range(count)]
+    if scenario == 'series':
+        return [f"{prefix}/meta/series/tt{9000001 + i:07d}.json" for i in range(count)]
+    if scenario == 'anime':
+        return [f"{prefix}/meta/series/{quote(f'kitsu:{1 + i % 200}')}.json" for i in range(count)]
+    raise ValueError(f"Unknown scenario {scenario}")
+
+
+async def run_pass(app_url: str, upstream_url: str, paths: list[str], concurrency: int) -> dict:
+    async with httpx.AsyncClient(timeout=120) as client:
+        await client.get(f"{upstream_url}/__bench/reset")
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, errors = [], 0
+
+        async def request(path: str):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(f"{app_url}{path}")
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[request(path) for path in paths])
+        elapsed = time.perf_counter() - start
+        upstream_calls = (await client.get(f"{upstream_url}/__bench/stats")).json()
+
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(paths),
+        "errors": errors,
+        "throughput": round(len(paths) / elapsed, 1),
+        "p50": round(percentiles[49], 1),
+        "p95": round(percentiles[94], 1),
+        "p99": round(percentiles[98], 1),
+        "upstream_calls": upstream_calls
+    }
+
+
+async def wait_ready(app_url: str, app_dir: str, process: subprocess.Popen):
+    index_path = os.path.join(app_dir, 'cache', 'anime', 'index.sqlite')
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() != None:
+                raise RuntimeError('App exited during startup')
+            try:
+                response = await client.get(f"{app_url}/manifest.json")
+                if response.status_code == 200 and os.path.exists(index_path):
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError('App not ready')
+
+
+def start_processes(args, app_dir: str) -> tuple:
+    upstream_port, app_port = free_port(), free_port()
+    upstream = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, 'fake_upstream.py'), '--port', str(upstream_port),
+        '--latency', str(args.latency), '--jitter', str(args.jitter),
+        '--error-rate', str(args.error_rate), '--throttle-rate', str(args.throttle_rate)
+    ])
+
+    env = {
+        **os.environ,
+        "UPSTREAM_OVERRIDE": f"http://127.0.0.1:{upstream_port}",
+        "ADMIN_PASSWORD": "bench",
+        "TVDB_API_KEY": "bench",
+        "FANART_API_KEY": "bench",
+        "PREFETCH_META_ITEMS": "10" if args.prefetch else "0"
+    }
+    app = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(app_port), '--log-level', 'warning'],
+        cwd=app_dir, env=env, stdout=None if args.verbose else subprocess.DEVNULL
+    )
+    return upstream, app, f"http://127.0.0.1:{upstream_port}", f"http://127.0.0.1:{app_port}"
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_results(results: dict, baseline: dict | None):
+    print(f"{'scenario':<16}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}  upstream calls")
+    for name, result in results.items():
+        calls = ', '.join(f"{host}={count}" for host, count in sorted(result['upstream_calls'].items()))
+        print(f"{name:<16}{result['throughput']:>9}{result['p50']:>10}{result['p95']:>10}{result['p99']:>10}{result['errors']:>8}  {calls or '-'}")
+
+        previous = (baseline or {}).get('results', {}).get(name)
+        if previous:
+            deltas = []
+            for metric in ('throughput', 'p50', 'p95', 'p99'):
+                if previous[metric]:
+                    deltas.append(f"{metric} {(result[metric] - previous[metric]) / previous[metric] * 100:+.0f}%")
+            calls_delta = sum(result['upstream_calls'].values()) - sum(previous['upstream_calls'].values())
+            print(f"{'':<16}vs {baseline['commit']}: {', '.join(deltas)}, upstream calls {calls_delta:+d}")
+
+
+async def main(args):
+    scenarios = args.scenarios.split(',')
+    app_dir = tempfile.mkdtemp(prefix='addon-bench-')
+    shutil.copytree(ROOT, app_dir, dirs_exist_ok=True, ignore=shutil.ignore_patterns('.git', 'cache', 'benchmarks', '__pycache__'))
+    upstream, app, upstream_url, app_url = start_processes(args, app_dir)
+
+    results = {}
+    try:
+        await wait_ready(app_url, app_dir, app)
+        for scenario in scenarios:
+            paths = scenario_paths(scenario, args.requests)
+            for phase in ('cold', 'warm'):
+                results[f"{scenario}/{phase}"] = await run_pass(app_url, upstream_url, paths, args.concurrency)
+    finally:
+        for process in (app, upstream):
+            process.terminate()
+            process.wait()
+        shutil.rmtree(app_dir, ignore_errors=True)
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({ "commit": git_commit(), "options": vars(args), "results": results }, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Addon benchmark against a fake upstream')
+    parser.add_argument('--requests', type=int, default=100, help='requests per scenario and phase')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=0.02, help='upstream latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--prefetch', action='store_true', help='keep catalog meta prefetch enabled')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--verbose', action='store_true', help='show the app output')
+    asyncio.run(main(parser.parse_args()))
@@ -1,29 +1,235 @@
 from diskcache import Cache as diskCache
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 #from cachetools import TTLCache
+import tracing
+import asyncio
+import pickle
+import time
+import os
+import re
+
+# In-memory tier size per cache, in items and bytes
+L1_MAXSIZE = int(os.getenv('CACHE_L1_MAXSIZE', 1024))
+L1_MAX_BYTES = int(os.getenv('CACHE_L1_MAX_BYTES', 16 * 1024 * 1024))
+# Total bytes of the in-memory tiers of all disk caches (one budget per process)
+L1_TOTAL_BYTES = int(os.getenv('CACHE_L1_TOTAL_BYTES', 128 * 1024 * 1024))
+
+# Disk reads run in a thread pool, writes in a single ordered write-behind thread
+disk_readers = ThreadPoolExecutor(max_workers=4, thread_name_prefix='cache-read')
+disk_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cache-write')
+
+_missing = object()
+
+
+class MemoryBudget():
+    """
+    Byte limit shared by several in-memory caches, the least recently used
+    entry of any of them is evicted first.
+    """
+
+    def __init__(self, max_bytes: int = L1_TOTAL_BYTES):
+        self.entries = OrderedDict()
+        self.max_bytes = max_bytes
+        self.bytes = 0
+
+    def add(self, cache: 'MemoryCache', key, size: int):
+        self.entries[(cache, key)] = size
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            (old_cache, old_key), old_size = self.entries.popitem(last=False)
+            self.bytes -= old_size
+            old_cache.delete(old_key)
+
+    def touch(self, cache: 'MemoryCache', key):
+        self.entries.move_to_end((cache, key))
+
+    def remove(self, cache: 'MemoryCache', key):
+        size = self.entries.pop((cache, key), None)
+        if size is not None:
+            self.bytes -= size
+
+
+class MemoryCache():
+    """
+    Bounded LRU with per entry expiry, limited by number of items and bytes,
+    and by a budget shared with other caches when given.
+    Values are kept by reference, they must not be modified after set.
+    """
+
+    def __init__(self, maxsize: int = L1_MAXSIZE, max_bytes: int = L1_MAX_BYTES, budget: MemoryBudget = None):
+        self.entries = OrderedDict()
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.budget = budget
+        self.bytes = 0
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+
+        value, expire_at, size = entry
+        if expire_at is not None and expire_at <= time.time():
+            self.delete(key)
+            return default
+
+        self.entries.move_to_end(key)
+        if self.budget is not None:
+            self.budget.touch(self, key)
+        return value
+
+    def set(self, key, value, expire_at: float = None, size: int = 0):
+        self.delete(key)
+        if size > self.max_bytes or (self.budget is not None and size > self.budget.max_bytes):
+            return
+
+        self.entries[key] = (value, expire_at, size)
+        self.bytes += size
+        while len(self.entries) > self.maxsize or self.bytes > self.max_bytes:
+            self.delete(next(iter(self.entries)))
+        if self.budget is not None:
+            self.budget.add(self, key, size)
+
+    def delete(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+            if self.budget is not None:
+                self.budget.remove(self, key)
+
+    def expire(self):
+        now = time.time()
+        for key in [key for key, entry in self.entries.items() if entry[1] is not None and entry[1] <= now]:
+            self.delete(key)
+
+    def clear(self):
+        for key in list(self.entries):
+            self.delete(key)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# In-memory tiers of the disk caches
+l1_budget = MemoryBudget(L1_TOTAL_BYTES)
+
 
 class Cache():
+    """
+    Disk cache with an in-memory tier. Both tiers keep the pickled value,
+    every get returns a new copy that callers can modify.
+    """
 
-    def __init__(self, dir: str, expires: int = None):
+    def __init__(self, dir: str, expires: int = None, l1_maxsize: int = L1_MAXSIZE, l1_max_bytes: int = L1_MAX_BYTES, name: str = None):
+        self.dir = dir
+        self.name = name or cache_name(dir)
         self.cache = diskCache(dir)
         self.expires = expires
+        self.memory = MemoryCache(l1_maxsize, l1_max_bytes, l1_budget)
+        self.hits = { 'memory': 0, 'disk': 0 }
+        self.misses = 0
+
+    def set(self, key, value, expire: float = None):
+        expire = self.expires if expire is None else expire
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.memory.set(key, data, time.time() + expire if expire else None, len(data))
 
-    def set(self, key, value):
-        self.cache.set(key, value, expire=self.expires)
+        # Write-behind when called from the event loop
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.cache.set(key, data, expire=expire)
+        else:
+            loop.run_in_executor(disk_writer, self._disk_set, key, data, expire)
 
     def get(self, key, default=None):
-        return self.cache.get(key, default)
-    
+        data = self.memory.get(key, _missing)
+        if data is not _missing:
+            self.hits['memory'] += 1
+            tracing.record_cache(self.name, True)
+            return pickle.loads(data)
+        return self._promote(key, self._disk_get(key), default)
+
+    async def aget(self, key, default=None):
+        data = self.memory.get(key, _missing)
+        if data is not _missing:
+            self.hits['memory'] += 1
+            tracing.record_cache(self.name, True)
+            return pickle.loads(data)
+        loop = asyncio.get_running_loop()
+        return self._promote(key, await loop.run_in_executor(disk_readers, self._disk_get, key), default)
+
+    # In-memory tier only, not counted in the stats
+    def get_memory(self, key, default=None):
+        data = self.memory.get(key, _missing)
+        return default if data is _missing else pickle.loads(data)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        return self.cache.delete(key)
+
     def clear(self):
+        self.memory.clear()
         return self.cache.clear()
 
     def expire(self):
+        self.memory.expire()
         return self.cache.expire()
-    
+
     def close(self):
         return self.cache.close()
-    
+
+    def stats(self) -> dict:
+        return {
+            "memory_hits": self.hits['memory'],
+            "disk_hits": self.hits['disk'],
+            "misses": self.misses,
+            "memory_items": len(self.memory),
+            "memory_bytes": self.memory.bytes
+        }
+
+    def _disk_set(self, key, data: bytes, expire: float):
+        try:
+            self.cache.set(key, data, expire=expire)
+        except Exception as e:
+            print(f"Cache write error {self.dir}: {e}")
+
+    def _disk_get(self, key):
+        value, expire_time = self.cache.get(key, _missing, expire_time=True)
+        if value is _missing:
+            return None
+        # Entries written before the in-memory tier are not pre-pickled
+        if isinstance(value, bytes):
+            return pickle.loads(value), value, expire_time
+        return value, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), expire_time
+
+    def _promote(self, key, entry, default):
+        if entry is None:
+            self.misses += 1
+            tracing.record_cache(self.name, False)
+            return default
+
+        value, data, expire_time = entry
+        self.hits['disk'] += 1
+        tracing.record_cache(self.name, True)
+        self.memory.set(key, data, expire_time, len(data))
+        return value
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
+
+
+# Trace label from the cache dir, './cache/it-IT/meta/tmp' -> 'meta'
+def cache_name(dir: str) -> str:
+    parts = [part for part in dir.split('/') if part not in ('', '.', 'cache', 'tmp') and not re.fullmatch(r'[a-z]{2,3}-[A-Z]{2}', part)]
+    return '-'.join(parts) or 'cache'
+
+
+# Wait for pending write-behind operations
+async def flush():
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(disk_writer, lambda: None)
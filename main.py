@@ -1,20 +1,31 @@
 from fastapi import FastAPI, Request, Response, Query
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import RedirectResponse, HTMLResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 from datetime import timedelta
-from cache import Cache
+from cache import Cache, MemoryCache
+import cache as cache_store
+from singleflight import SingleFlight
+from background import WorkerPool
 from anime import kitsu, mal
 from anime import anime_mapping
+from anime import anime_index
 import meta_merger
 import meta_builder
 import translator
+import ttl_policy
+import responses
+import overlay
+import tracing
+import metrics
 import asyncio
-import httpx
 from api import tmdb
+from api import http_client
+import functools
 import base64
 import json
+import time
 import os
 
 # Settings
@@ -24,8 +35,38 @@ FORCE_META = False
 USE_TMDB_ID_META = True
 USE_TMDB_ADDON = False
 TRANSLATE_CATALOG_NAME = False
-REQUEST_TIMEOUT = 120
 COMPATIBILITY_ID = ['tt', 'kitsu', 'mal']
+CATALOG_CACHE_TTL = 600
+CATALOG_CACHE_STALE = 3600
+CATALOG_CACHE_SIZE = 2048
+
+# Client and CDN caching, meta and catalog headers follow their cache entries
+HTTP_MAX_AGE = int(os.getenv('HTTP_MAX_AGE', 3600))
+HTTP_STALE_WHILE_REVALIDATE = int(os.getenv('HTTP_STALE_WHILE_REVALIDATE', 86400))
+ROUTE_CACHE = {
+    'manifest': (3600, 86400),
+    'addon_catalog': (600, 3600),
+    'languages': (86400, 604800)
+}
+META_CACHE_STALE = timedelta(days=7).total_seconds()
+# Base metas outlive the overlays built on them
+META_BASE_TTL = ttl_policy.OLD_META_TTL + META_CACHE_STALE
+META_RESPONSE_CACHE_SIZE = 2048
+# Metas of other languages warmed from TMDB translations, served once and rebuilt in background
+WARM_META_TTL = timedelta(days=1).total_seconds()
+META_RESPONSE_CACHE_BYTES = 64 * 1024 * 1024
+REFRESH_WORKERS = 4
+REFRESH_QUEUE_SIZE = 1000
+
+# Meta prefetch of the first catalog items, disabled by default (opt in with a count)
+PREFETCH_META_ITEMS = int(os.getenv('PREFETCH_META_ITEMS', 0))
+PREFETCH_WORKERS = 2
+PREFETCH_QUEUE_SIZE = 500
+PREFETCH_RATE = 5
+PREFETCH_TMDB_RESERVE = 25
+
+# Parallel anime id conversions of a catalog
+ANIME_CONVERT_CONCURRENCY = 10
 
 # ENV file
 ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD')
@@ -34,22 +75,53 @@ ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD')
 with open("languages/languages.json", "r", encoding="utf-8") as f:
     LANGUAGES = json.load(f) 
 
-# Cache set
+# Cache set, a meta is stored once as the base and every language as an overlay on it
+meta_base_cache = Cache("./cache/neutral/metas", META_BASE_TTL)
 meta_cache = {}
 for language in LANGUAGES:
-    meta_cache[language] = Cache(f"./cache/{language}/meta/tmp",  timedelta(hours=12).total_seconds())
+    # Overlay entries, not readable from the raw metas of ./cache/{language}/meta/tmp
+    meta_cache[language] = Cache(f"./cache/{language}/meta/v2",  timedelta(hours=12).total_seconds(), name='meta')
     #meta_cache[language].clear()
 
+# Pre-serialized meta responses (in memory)
+meta_responses = MemoryCache(META_RESPONSE_CACHE_SIZE, META_RESPONSE_CACHE_BYTES)
+
+# Translated catalogs (in memory)
+catalog_cache = MemoryCache(maxsize=CATALOG_CACHE_SIZE)
+catalog_lookups = { "hit": 0, "miss": 0 }
+
+# In-flight meta and catalog builds
+meta_flight = SingleFlight()
+catalog_flight = SingleFlight()
+
+# Stale meta and catalog refreshes
+refresh_pool = WorkerPool(REFRESH_WORKERS, REFRESH_QUEUE_SIZE)
+
+# Meta builds of catalog items, rate limited
+prefetch_pool = WorkerPool(PREFETCH_WORKERS, PREFETCH_QUEUE_SIZE, 1 / PREFETCH_RATE)
+
 
 # Server start
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print('Started')
-    # Load anime mapping lists
-    await anime_mapping.download_maps()
-    kitsu.load_anime_map()
-    mal.load_anime_map()
+    start = time.perf_counter()
+    # Shared upstream connection pools
+    await http_client.open_clients()
+    # Anime mapping index from the last snapshot, lists refreshed in background
+    anime_mapping.start_refresh()
+    refresh_pool.start()
+    prefetch_pool.start()
+    tmdb.warm_pool.start()
+    metrics.start_lag_monitor()
+    print(f"Started in {(time.perf_counter() - start) * 1000:.0f} ms")
     yield
+    await anime_mapping.stop_refresh()
+    await metrics.stop_lag_monitor()
+    await prefetch_pool.stop()
+    await tmdb.warm_pool.stop()
+    await refresh_pool.stop()
+    await http_client.close_clients()
+    await cache_store.flush()
     print('Shutdown')
     
 
@@ -57,6 +129,26 @@ app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# Path params left out of traces, user settings hold the API keys
+TRACE_HIDDEN_PARAMS = ['addon_url', 'user_settings']
+
+
+# Upstream time breakdown and latency metrics of every request
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    trace = tracing.start()
+    response = await call_next(request)
+    if tracing.SERVER_TIMING:
+        response.headers['Server-Timing'] = trace.server_timing()
+        response.headers['Timing-Allow-Origin'] = '*'
+
+    route = request.scope.get('route')
+    route_path = route.path if route != None else 'unmatched'
+    metrics.observe_request(request.method, route_path, response.status_code, trace.duration_ms() / 1000)
+    params = { key: value for key, value in request.path_params.items() if key not in TRACE_HIDDEN_PARAMS }
+    tracing.log_slow(trace, route_path, params, response.status_code)
+    return response
+
 
 stremio_headers = {
     'connection': 'keep-alive', 
@@ -79,16 +171,48 @@ tmdb_addon_meta_url = tmdb_addons_pool[0]
 cinemeta_url = 'https://v3-cinemeta.strem.io'
 
 def json_response(data):
-    response = JSONResponse(data)
+    response = Response(responses.dumps(data), media_type='application/json')
+    return add_headers(response)
+
+
+# Pre-serialized response, cacheable by clients and CDN for max_age seconds
+def cached_response(request: Request, encoded: dict, max_age: float, stale: float, surrogate_keys: list[str] = []):
+    response = responses.encoded_response(request, encoded)
+    return add_headers(response, max_age, stale, surrogate_keys)
+
+
+def add_headers(response: Response, max_age: float = None, stale: float = 0, surrogate_keys: list[str] = []) -> Response:
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Headers'] = '*'
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Pragma"] = "no-cache"
-    response.headers["Expires"] = "0"
-    response.headers["Surrogate-Control"] = "no-store"
+    if max_age == None:
+        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+        response.headers["Pragma"] = "no-cache"
+        response.headers["Expires"] = "0"
+        response.headers["Surrogate-Control"] = "no-store"
+        return response
+
+    max_age = int(min(max(max_age, 0), HTTP_MAX_AGE))
+    stale = int(min(max(stale, 0), HTTP_STALE_WHILE_REVALIDATE))
+    response.headers["Cache-Control"] = f"public, max-age={max_age}, stale-while-revalidate={stale}"
+    # CDN purge by key
+    if surrogate_keys:
+        response.headers["Surrogate-Key"] = ' '.join(surrogate_keys)
     return response
 
 
+def route_response(request: Request, data, route: str):
+    max_age, stale = ROUTE_CACHE[route]
+    return cached_response(request, responses.encode_json(data), max_age, stale, [route])
+
+
+# Meta or catalog cache entry, fresh until its soft expiry then stale until the hard one
+def entry_response(request: Request, entry: dict, stale_window: float, surrogate_keys: list[str]):
+    now = time.time()
+    max_age = max(entry['fresh_until'] - now, 0)
+    stale = entry['fresh_until'] + stale_window - now - max_age
+    return cached_response(request, entry['response'], max_age, stale, surrogate_keys)
+
+
 @app.get('/', response_class=HTMLResponse)
 @app.get('/configure', response_class=HTMLResponse)
 async def home(request: Request):
@@ -115,19 +239,18 @@ async def link_generator(request: Request):
 
 
 @app.get("/manifest.json")
-async def get_manifest():
+async def get_manifest(request: Request):
     with open("manifest.json", "r", encoding="utf-8") as f:
         manifest = json.load(f)
-    return json_response(manifest)
+    return route_response(request, manifest, 'manifest')
 
 
 @app.get('/{addon_url}/{user_settings}/manifest.json')
-async def get_manifest(addon_url, user_settings):
+async def get_manifest(request: Request, addon_url, user_settings):
     addon_url = decode_base64_url(addon_url)
     user_settings = parse_user_settings(user_settings)
-    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT) as client:
-        response = await client.get(f"{addon_url}/manifest.json")
-        manifest = response.json()
+    response = await http_client.get_client('addon').get(f"{addon_url}/manifest.json")
+    manifest = response.json()
 
     is_translated = manifest.get('translated', False)
     if not is_translated:
@@ -142,11 +265,10 @@ async def get_manifest(addon_url, user_settings):
 
         # Translate catalog names
         if TRANSLATE_CATALOG_NAME:
-            async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT) as client:
-                tasks = [ translator.translate_with_api(client, catalog['name'], manifest['t_language']) for catalog in manifest['catalogs'] ]
-                translations =  await asyncio.gather(*tasks)
-                for i, catalog in enumerate(manifest['catalogs']):
-                    catalog['name'] = translations[i]
+            tasks = [ translator.translate_with_api(catalog['name'], manifest['t_language']) for catalog in manifest['catalogs'] ]
+            translations =  await asyncio.gather(*tasks)
+            for i, catalog in enumerate(manifest['catalogs']):
+                catalog['name'] = translations[i]
     
     if FORCE_PREFIX:
         if 'idPrefixes' in manifest:
@@ -159,11 +281,11 @@ async def get_manifest(addon_url, user_settings):
         if 'meta' not in manifest['resources']:
             manifest['resources'].append('meta')
 
-    return json_response(manifest)
+    return route_response(request, manifest, 'manifest')
 
 
 @app.get("/{addon_url}/{user_settings}/catalog/{type}/{path:path}")
-async def get_catalog(response: Response, addon_url, type: str, user_settings: str, path: str):
+async def get_catalog(request: Request, response: Response, addon_url, type: str, user_settings: str, path: str):
     # User settings
     user_settings = parse_user_settings(user_settings)
     language = user_settings.get('language', 'it-IT')
@@ -176,51 +298,108 @@ async def get_catalog(response: Response, addon_url, type: str, user_settings: s
     # Convert addon base64 url
     addon_url = decode_base64_url(addon_url)
 
-    async with httpx.AsyncClient(follow_redirects=True, timeout=REQUEST_TIMEOUT) as client:
-        response = await client.get(f"{addon_url}/catalog/{type}/{path}")
+    # Cinemeta last-videos and calendar
+    if 'last-videos' in path or 'calendar-videos' in path:
+        response = await http_client.get_client('addon').get(f"{addon_url}/catalog/{type}/{path}")
+        return json_response(response.json())
 
-        # Cinemeta last-videos and calendar
-        if 'last-videos' in path or 'calendar-videos' in path:
-            return json_response(response.json())
-        
-        try:
-            catalog = response.json()
-        except:
-            print(f"Error on load catalog: {response.status_code}")
-            return json_response({})
-        
-        if type == 'anime':
-            await remove_duplicates(catalog)
+    # Translated catalog cache
+    key = (addon_url, type, path, language, rpdb, rpdb_key, toast_ratings, top_stream_poster)
+    build = lambda: build_catalog(key, addon_url, type, path, language, tmdb_key, rpdb, rpdb_key, toast_ratings, top_stream_poster)
+    surrogate_keys = ['catalog', f"catalog:{type}", f"language:{language}"]
+    entry = catalog_cache.get(key)
+    catalog_lookups['hit' if entry != None else 'miss'] += 1
+    tracing.record_cache('catalog', entry != None)
+
+    if entry != None:
+        # Stale, serve it and refresh in background
+        if time.time() > entry['fresh_until'] and not catalog_flight.is_running(key):
+            refresh_pool.submit(('catalog', key), lambda: catalog_flight.do(key, build))
+        prefetch_metas(entry['prefetch_items'], addon_url, language, tmdb_key)
+        return entry_response(request, entry, CATALOG_CACHE_STALE, surrogate_keys)
+
+    new_catalog = await catalog_flight.do(key, build)
+    prefetch_metas(new_catalog.get('metas', []), addon_url, language, tmdb_key)
+
+    # Built and cached, answer from the cache entry
+    entry = catalog_cache.get(key)
+    if entry != None:
+        return entry_response(request, entry, CATALOG_CACHE_STALE, surrogate_keys)
+    return json_response(new_catalog)
 
-        if 'metas' in catalog:
-            tasks = []
-            for item in catalog['metas']:
-                id = item.get('imdb_id', item.get('id'))
-                cached = tmdb.tmp_cache[language].get(id)
 
-                if cached:
-                    tasks.append(asyncio.sleep(0, result=cached))
-                else:
-                    if type == 'anime':
-                        if item.get("animeType") in ("TV", "movie"):
-                            tasks.append(tmdb.get_tmdb_data(client, id, "imdb_id", language, tmdb_key))
-                        else:
-                            tasks.append(asyncio.sleep(0, result={}))
+async def build_catalog(key: tuple, addon_url: str, type: str, path: str, language: str, tmdb_key: str, rpdb: str, rpdb_key: str, toast_ratings: str, top_stream_poster: str) -> dict:
+    response = await http_client.get_client('addon').get(f"{addon_url}/catalog/{type}/{path}")
+
+    try:
+        catalog = response.json()
+    except:
+        print(f"Error on load catalog: {response.status_code}")
+        return {}
+    
+    if type == 'anime':
+        await remove_duplicates(catalog)
+
+    if 'metas' in catalog:
+        tasks = []
+        for item in catalog['metas']:
+            id = item.get('imdb_id', item.get('id'))
+            cached = await tmdb.tmp_cache[language].aget(id)
+
+            if cached:
+                tasks.append(asyncio.sleep(0, result=cached))
+            else:
+                if type == 'anime':
+                    if item.get("animeType") in ("TV", "movie"):
+                        tasks.append(tmdb.get_tmdb_data(id, "imdb_id", language, tmdb_key))
                     else:
-                        tasks.append(tmdb.get_tmdb_data(client, id, "imdb_id", language, tmdb_key))
+                        tasks.append(asyncio.sleep(0, result={}))
+                else:
+                    tasks.append(tmdb.get_tmdb_data(id, "imdb_id", language, tmdb_key))
 
-            tmdb_details = await asyncio.gather(*tasks)
-        else:
-            return json_response({})
+        tmdb_details = await asyncio.gather(*tasks)
+    else:
+        return {}
 
     new_catalog = translator.translate_catalog(catalog, tmdb_details, top_stream_poster, toast_ratings, rpdb, rpdb_key, language)
-    return json_response(new_catalog)
+
+    # Not cache invalid TMDB key responses
+    if not any(detail.get('error') for detail in tmdb_details):
+        catalog_cache.set(key, {
+            "response": responses.encode_json(new_catalog),
+            "prefetch_items": [{ "id": item.get('id', ''), "type": item.get('type') } for item in new_catalog.get('metas', [])[:PREFETCH_META_ITEMS]],
+            "fresh_until": time.time() + CATALOG_CACHE_TTL
+        }, time.time() + CATALOG_CACHE_TTL + CATALOG_CACHE_STALE)
+    return new_catalog
+
+
+# Queue meta builds for the first catalog items not in cache
+def prefetch_metas(items: list, addon_url: str, language: str, tmdb_key: str) -> None:
+    for item in items[:PREFETCH_META_ITEMS]:
+        id = item.get('id', '')
+        type = item.get('type')
+        key = (language, type, id)
+
+        if type not in ('movie', 'series') or not any(prefix in id for prefix in COMPATIBILITY_ID):
+            continue
+        if meta_responses.get((language, id)) != None or meta_flight.is_running(key):
+            continue
+        prefetch_pool.submit(('meta', key), functools.partial(prefetch_meta, addon_url, type, id, language, tmdb_key))
+
+
+async def prefetch_meta(addon_url: str, type: str, id: str, language: str, tmdb_key: str) -> None:
+    key = (language, type, id)
+    if await meta_cache[language].aget(id) != None or meta_flight.is_running(key):
+        return
+
+    # Leave TMDB requests to user requests
+    if tmdb.available_requests(tmdb_key) < PREFETCH_TMDB_RESERVE:
+        return
+    await meta_flight.do(key, lambda: build_meta(addon_url, type, id, language, tmdb_key))
 
 
 @app.get('/{addon_url}/{user_settings}/meta/{type}/{id}.json')
 async def get_meta(request: Request,response: Response, addon_url, user_settings: str, type: str, id: str):
-    global tmdb_addon_meta_url
-
     headers = dict(request.headers)
     del headers['host']
 
@@ -229,188 +408,283 @@ async def get_meta(request: Request,response: Response, addon_url, user_settings
     language = user_settings.get('language', 'it-IT')
     tmdb_key = user_settings.get('tmdb_key', None)
 
-    async with httpx.AsyncClient(follow_redirects=True, timeout=REQUEST_TIMEOUT) as client:
+    key = (language, type, id)
+    build = lambda: build_meta(addon_url, type, id, language, tmdb_key)
+    surrogate_keys = ['meta', f"meta:{id}", f"language:{language}"]
+
+    # Get from cache
+    entry = await get_meta_entry(language, id)
+
+    # Return cached meta
+    if entry != None:
+        # Stale, serve it and refresh in background
+        if time.time() > entry['fresh_until'] and not meta_flight.is_running(key):
+            refresh_pool.submit(('meta', key), lambda: meta_flight.do(key, build))
+        return entry_response(request, entry, META_CACHE_STALE, surrogate_keys)
+
+    # Not in cache, concurrent requests share a single build
+    meta = await meta_flight.do(key, build)
+
+    # Built and cached, answer from the cache entry
+    entry = meta_responses.get((language, id))
+    if entry != None:
+        return entry_response(request, entry, META_CACHE_STALE, surrogate_keys)
+    return json_response(meta)
+
+
+# Cached meta with its pre-serialized response, assembled from the base and the language overlay
+async def get_meta_entry(language: str, id: str) -> dict | None:
+    entry = meta_responses.get((language, id))
+    if entry != None:
+        return entry
+
+    stored, base = await asyncio.gather(meta_cache[language].aget(id), meta_base_cache.aget(id))
+    # Overlays of a replaced base are not valid
+    if stored == None or base == None or stored['base'] != base['version']:
+        return None
+    return cache_meta_response(language, id, overlay.apply_meta(base['meta'], stored['overlay']), stored['fresh_until'], stored['expire_at'])
+
+
+def cache_meta_response(language: str, id: str, meta: dict, fresh_until: float, expire_at: float) -> dict:
+    entry = { "response": responses.encode_json(meta), "fresh_until": fresh_until }
+    size = sum(len(body) for body in entry['response'].values() if isinstance(body, bytes))
+    meta_responses.set((language, id), entry, expire_at, size)
+    return entry
+
+
+async def store_meta(language: str, id: str, meta: dict, ttl: float, stale: float) -> None:
+    now = time.time()
+    # First language built is the base, never replaced while other overlays use it
+    base = await meta_base_cache.aget(id)
+    if base == None:
+        base = { "version": now, "meta": meta }
+        meta_base_cache.set(id, base)
 
-        # Get from cache
-        meta = meta_cache[language].get(id)
+    meta_cache[language].set(id, {
+        "base": base['version'],
+        "overlay": overlay.diff_meta(meta, base['meta']),
+        "fresh_until": now + ttl,
+        "expire_at": now + ttl + stale
+    }, ttl + stale)
+    cache_meta_response(language, id, meta, now + ttl, now + ttl + stale)
 
-        # Return cached meta
-        if meta != None:
-            return json_response(meta)
 
-        # Not in cache
+async def build_meta(addon_url: str, type: str, id: str, language: str, tmdb_key: str) -> dict:
+    global tmdb_addon_meta_url
+    build = ttl_policy.start_build()
+
+    # Handle imdb ids
+    if 'tt' in id:
+        if USE_TMDB_ADDON:
+            tmdb_id = await tmdb.convert_imdb_to_tmdb(id, language, tmdb_key)
+            tasks = [
+                http_client.get_client('addon').get(f"{tmdb_addon_meta_url}/meta/{type}/{tmdb_id}.json"),
+                http_client.get_client('cinemeta').get(f"{cinemeta_url}/meta/{type}/{id}.json")
+            ]
+            metas = await asyncio.gather(*tasks)
+        
+            # TMDB addon retry and switch addon
+            for retry in range(6):
+                if metas[0].status_code == 200:
+                    tmdb_meta = metas[0].json()
+                    break
+                else:
+                    index = tmdb_addons_pool.index(tmdb_addon_meta_url)
+                    tmdb_addon_meta_url = tmdb_addons_pool[(index + 1) % len(tmdb_addons_pool)]
+                    metas[0] = await http_client.get_client('addon').get(f"{tmdb_addon_meta_url}/meta/{type}/{tmdb_id}.json")
+                    if metas[0].status_code == 200:
+                        tmdb_meta = metas[0].json()
+                        break
+            tmdb_meta = metas[0]
+
+            if metas[1].status_code == 200:
+                cinemeta_meta = metas[1].json()
+            else:
+                cinemeta_meta = {}
         else:
-            # Handle imdb ids
-            if 'tt' in id:
-                if USE_TMDB_ADDON:
-                    tmdb_id = await tmdb.convert_imdb_to_tmdb(id, language, tmdb_key)
-                    tasks = [
-                        client.get(f"{tmdb_addon_meta_url}/meta/{type}/{tmdb_id}.json"),
-                        client.get(f"{cinemeta_url}/meta/{type}/{id}.json")
-                    ]
-                    metas = await asyncio.gather(*tasks)
+            # Not use TMDB Addon
+            tmdb_meta, cinemeta_meta = await  meta_builder.build_metadata(id, type, language, tmdb_key)
+        
+        # Not empty tmdb meta
+        if len(tmdb_meta.get('meta', [])) > 0:
+            # Invalid TMDB key error
+            if 'error' in tmdb_meta['meta']['id']:
+                return tmdb_meta
+            
+            # Not merge anime
+            if not anime_index.is_anime(id):
+                tasks = []
+                meta, merged_videos = meta_merger.merge(tmdb_meta, cinemeta_meta)
+                tmdb_description = tmdb_meta['meta'].get('description', '')
                 
-                    # TMDB addon retry and switch addon
-                    for retry in range(6):
-                        if metas[0].status_code == 200:
-                            tmdb_meta = metas[0].json()
-                            break
-                        else:
-                            index = tmdb_addons_pool.index(tmdb_addon_meta_url)
-                            tmdb_addon_meta_url = tmdb_addons_pool[(index + 1) % len(tmdb_addons_pool)]
-                            metas[0] = await client.get(f"{tmdb_addon_meta_url}/meta/{type}/{tmdb_id}.json")
-                            if metas[0].status_code == 200:
-                                tmdb_meta = metas[0].json()
-                                break
-                    tmdb_meta = metas[0]
-
-                    if metas[1].status_code == 200:
-                        cinemeta_meta = metas[1].json()
-                    else:
-                        cinemeta_meta = {}
-                else:
-                    # Not use TMDB Addon
-                    tmdb_meta, cinemeta_meta = await  meta_builder.build_metadata(id, type, language, tmdb_key)
+                if tmdb_description == '':
+                    tasks.append(translator.translate_with_api(meta['meta'].get('description', ''), language))
+
+                if type == 'series' and (len(meta['meta']['videos']) < len(merged_videos)):
+                    tasks.append(translator.translate_episodes(merged_videos, language, tmdb_key))
+
+                translated_tasks = await asyncio.gather(*tasks)
+                for task in translated_tasks:
+                    if isinstance(task, list):
+                        meta['meta']['videos'] = task
+                    elif isinstance(task, str):
+                        meta['meta']['description'] = task
+            else:
+                meta = tmdb_meta
+
+        # Empty tmdb_data
+        else:
+            if len(cinemeta_meta.get('meta', [])) > 0:
+                meta = cinemeta_meta
+                description = meta['meta'].get('description', '')
                 
-                # Not empty tmdb meta
-                if len(tmdb_meta.get('meta', [])) > 0:
-                    # Invalid TMDB key error
-                    if 'error' in tmdb_meta['meta']['id']:
-                        return json_response(tmdb_meta)
-                    
-                    # Not merge anime
-                    if id not in kitsu.imdb_ids_map:
-                        tasks = []
-                        meta, merged_videos = meta_merger.merge(tmdb_meta, cinemeta_meta)
-                        tmdb_description = tmdb_meta['meta'].get('description', '')
-                        
-                        if tmdb_description == '':
-                            tasks.append(translator.translate_with_api(client, meta['meta'].get('description', ''), language))
-
-                        if type == 'series' and (len(meta['meta']['videos']) < len(merged_videos)):
-                            tasks.append(translator.translate_episodes(client, merged_videos, language, tmdb_key))
-
-                        translated_tasks = await asyncio.gather(*tasks)
-                        for task in translated_tasks:
-                            if isinstance(task, list):
-                                meta['meta']['videos'] = task
-                            elif isinstance(task, str):
-                                meta['meta']['description'] = task
-                    else:
-                        meta = tmdb_meta
+                if type == 'series':
+                    tasks = [
+                        translator.translate_with_api(description, language),
+                        translator.translate_episodes(meta['meta']['videos'], language, tmdb_key)
+                    ]
+                    description, episodes = await asyncio.gather(*tasks)
+                    meta['meta']['videos'] = episodes
 
-                # Empty tmdb_data
-                else:
-                    if len(cinemeta_meta.get('meta', [])) > 0:
-                        meta = cinemeta_meta
-                        description = meta['meta'].get('description', '')
-                        
-                        if type == 'series':
-                            tasks = [
-                                translator.translate_with_api(client, description, language),
-                                translator.translate_episodes(client, meta['meta']['videos'], language, tmdb_key)
-                            ]
-                            description, episodes = await asyncio.gather(*tasks)
-                            meta['meta']['videos'] = episodes
-
-                        elif type == 'movie':
-                            description = await translator.translate_with_api(client, description, language)
-
-                        meta['meta']['description'] = description
-                    
-                    # Empty cinemeta and tmdb return empty meta
+                elif type == 'movie':
+                    description = await translator.translate_with_api(description, language)
+
+                meta['meta']['description'] = description
+            
+            # Empty cinemeta and tmdb return empty meta
+            else:
+                return {}
+            
+        
+    # Handle kitsu and mal ids
+    elif 'kitsu' in id or 'mal' in id:
+        # Get meta from kitsu addon
+        id = id.replace('_',':')
+        response = await http_client.get_client('kitsu').get(f"{kitsu.kitsu_addon_url}/meta/{type}/{id.replace(':','%3A')}.json")
+        meta = response.json()
+
+        # Extract imdb id, anime type and check convertion to imdb id
+        if 'kitsu' in meta['meta']['id']:
+            imdb_id, is_converted = await kitsu.convert_to_imdb(meta['meta']['id'], meta['meta']['type'])
+        elif 'mal_' in meta['meta']['id']:
+            imdb_id, is_converted = await mal.convert_to_imdb(meta['meta']['id'].replace('_',':'), meta['meta']['type'])
+        meta['meta']['imdb_id'] = imdb_id
+        anime_type = meta['meta'].get('animeType', None)
+        is_converted = imdb_id != None and 'tt' in imdb_id and (anime_type == 'TV' or anime_type == 'movie')
+
+        # Handle converted ids (TV and movies)
+        if is_converted:
+            if USE_TMDB_ADDON:
+                tmdb_id = await tmdb.convert_imdb_to_tmdb(imdb_id, language, tmdb_key)
+                # TMDB Addons retry
+                for retry in range(6):
+                    response = await http_client.get_client('addon').get(f"{tmdb_addon_meta_url}/meta/{type}/{tmdb_id}.json")
+                    if response.status_code == 200:
+                        meta = response.json()
+                        break
                     else:
-                        return json_response({})
-                    
-                
-            # Handle kitsu and mal ids
-            elif 'kitsu' in id or 'mal' in id:
+                        # Loop addon pool
+                        index = tmdb_addons_pool.index(tmdb_addon_meta_url)
+                        tmdb_addon_meta_url = tmdb_addons_pool[(index + 1) % len(tmdb_addons_pool)]
+                        print(f"Switch to {tmdb_addon_meta_url}")
+            else:
+                meta, cinemeta_meta = await meta_builder.build_metadata(imdb_id, type, language, tmdb_key)
+
+            if len(meta['meta']) > 0:
+                if type == 'movie':
+                    meta['meta']['behaviorHints']['defaultVideoId'] = id
+                elif type == 'series':
+                    videos = kitsu.parse_meta_videos(meta['meta']['videos'], imdb_id)
+                    meta['meta']['videos'] = videos
+            else:
                 # Get meta from kitsu addon
-                id = id.replace('_',':')
-                response = await client.get(f"{kitsu.kitsu_addon_url}/meta/{type}/{id.replace(':','%3A')}.json")
+                response = await http_client.get_client('kitsu').get(f"{kitsu.kitsu_addon_url}/meta/{type}/{id.replace(':','%3A')}.json")
                 meta = response.json()
 
-                # Extract imdb id, anime type and check convertion to imdb id
-                if 'kitsu' in meta['meta']['id']:
-                    imdb_id, is_converted = await kitsu.convert_to_imdb(meta['meta']['id'], meta['meta']['type'])
-                elif 'mal_' in meta['meta']['id']:
-                    imdb_id, is_converted = await mal.convert_to_imdb(meta['meta']['id'].replace('_',':'), meta['meta']['type'])
-                meta['meta']['imdb_id'] = imdb_id
-                anime_type = meta['meta'].get('animeType', None)
-                is_converted = imdb_id != None and 'tt' in imdb_id and (anime_type == 'TV' or anime_type == 'movie')
-
-                # Handle converted ids (TV and movies)
-                if is_converted:
-                    if USE_TMDB_ADDON:
-                        tmdb_id = await tmdb.convert_imdb_to_tmdb(imdb_id, language, tmdb_key)
-                        # TMDB Addons retry
-                        for retry in range(6):
-                            response = await client.get(f"{tmdb_addon_meta_url}/meta/{type}/{tmdb_id}.json")
-                            if response.status_code == 200:
-                                meta = response.json()
-                                break
-                            else:
-                                # Loop addon pool
-                                index = tmdb_addons_pool.index(tmdb_addon_meta_url)
-                                tmdb_addon_meta_url = tmdb_addons_pool[(index + 1) % len(tmdb_addons_pool)]
-                                print(f"Switch to {tmdb_addon_meta_url}")
-                    else:
-                        meta, cinemeta_meta = await meta_builder.build_metadata(imdb_id, type, language, tmdb_key)
-
-                    if len(meta['meta']) > 0:
-                        if type == 'movie':
-                            meta['meta']['behaviorHints']['defaultVideoId'] = id
-                        elif type == 'series':
-                            videos = kitsu.parse_meta_videos(meta['meta']['videos'], imdb_id)
-                            meta['meta']['videos'] = videos
-                    else:
-                        # Get meta from kitsu addon
-                        response = await client.get(f"{kitsu.kitsu_addon_url}/meta/{type}/{id.replace(':','%3A')}.json")
-                        meta = response.json()
-
-                # Handle not corverted and ONA OVA Specials
-                else:
-                    tasks = []
-                    description = meta['meta'].get('description', '')
-                    videos = meta['meta'].get('videos', [])
-
-                    if description:
-                        tasks.append(translator.translate_with_api(client, description, language))
-
-                    if type == 'series' and videos:
-                        tasks.append(translator.translate_episodes_with_api(client, videos, language))
+        # Handle not corverted and ONA OVA Specials
+        else:
+            tasks = []
+            description = meta['meta'].get('description', '')
+            videos = meta['meta'].get('videos', [])
 
-                    translations = await asyncio.gather(*tasks)
+            if description:
+                tasks.append(translator.translate_with_api(description, language))
 
-                    idx = 0
-                    if description:
-                        meta['meta']['description'] = translations[idx]
-                        idx += 1
+            if type == 'series' and videos:
+                tasks.append(translator.translate_episodes_with_api(videos, language))
 
-                    if type == 'series' and videos:
-                        meta['meta']['videos'] = translations[idx]
+            translations = await asyncio.gather(*tasks)
 
-            # Handle TMDB ids
-            elif 'tmdb' in id:
-                meta, placeholder = await meta_builder.build_metadata(id, type, language, tmdb_key)
-            # Not compatible id
-            else:
-                response = await client.get(f"{addon_url}/meta/{type}/{id}.json")
-                return json_response(response.json())
+            idx = 0
+            if description:
+                meta['meta']['description'] = translations[idx]
+                idx += 1
 
+            if type == 'series' and videos:
+                meta['meta']['videos'] = translations[idx]
 
-            meta['meta']['id'] = id
-            meta_cache[language].set(id, meta)
-            return json_response(meta)
+    # Handle TMDB ids
+    elif 'tmdb' in id:
+        meta, placeholder = await meta_builder.build_metadata(id, type, language, tmdb_key)
+    # Not compatible id
+    else:
+        response = await http_client.get_client('addon').get(f"{addon_url}/meta/{type}/{id}.json")
+        return response.json()
+
+
+    source_id = str(meta['meta'].get('id', ''))
+    meta['meta']['id'] = id
+    # Degraded metas are not served stale for longer than they are fresh
+    ttl = ttl_policy.meta_ttl(meta, build['degraded'])
+    stale = min(META_CACHE_STALE, ttl) if build['degraded'] else META_CACHE_STALE
+    await store_meta(language, id, meta, ttl, stale)
+
+    # Other languages from a single TMDB translations request
+    if tmdb.WARM_LANGUAGES and source_id.startswith('tmdb:') and not build['degraded']:
+        tmdb.warm_pool.submit(('warm', type, id), functools.partial(warm_metas, type, id, source_id.removeprefix('tmdb:'), language, tmdb_key))
+    return meta
+
+
+async def warm_metas(type: str, id: str, tmdb_id: str, language: str, tmdb_key: str) -> None:
+    """
+    Metas of the other warm-up languages with a full TMDB translation: the
+    localized title and overview over the base meta, the rest (genres,
+    images, episodes) is the base one. They are stale from the start, the
+    first request serves one and rebuilds it in background.
+    """
+    def missing(other: str) -> bool:
+        return not meta_flight.is_running((other, type, id)) and meta_cache[other].get_memory(id) == None
+
+    languages = [other for other in tmdb.warm_language_list() if other != language and missing(other) and await meta_cache[other].aget(id) == None]
+    if not languages or tmdb.available_requests(tmdb_key) < tmdb.WARM_TMDB_RESERVE:
+        return
+
+    translations, base = await asyncio.gather(tmdb.get_translations(type, tmdb_id, language, tmdb_key), meta_base_cache.aget(id))
+    if base == None:
+        return
+
+    now = time.time()
+    for other in languages:
+        # Built meanwhile
+        if other not in translations or not missing(other):
+            continue
+        meta = { **base['meta'], "meta": { **base['meta']['meta'], **translations[other] } }
+        meta_cache[other].set(id, {
+            "base": base['version'],
+            "overlay": overlay.diff_meta(meta, base['meta']),
+            "fresh_until": now,
+            "expire_at": now + WARM_META_TTL
+        }, WARM_META_TTL)
 
 
 # Addon catalog reponse
 @app.get('/{addon_url}/{user_settings}/addon_catalog/{path:path}')
-async def get_addon_catalog(addon_url, path: str):
+async def get_addon_catalog(request: Request, addon_url, path: str):
     addon_url = decode_base64_url(addon_url)
-    async with httpx.AsyncClient(follow_redirects=True, timeout=REQUEST_TIMEOUT) as client:
-        response = await client.get(f"{addon_url}/addon_catalog/{path}")
+    response = await http_client.get_client('addon').get(f"{addon_url}/addon_catalog/{path}")
+    if response.status_code != 200:
         return json_response(response.json())
+    return route_response(request, response.json(), 'addon_catalog')
 
 # Subs redirect
 @app.get('/{addon_url}/{user_settings}/subtitles/{path:path}')
@@ -429,9 +703,7 @@ async def get_subs(addon_url, path: str):
 @app.get('/map_reload')
 async def reload_anime_mapping(password: str = Query(...)):
     if password == ADMIN_PASSWORD:
-        await anime_mapping.download_maps()
-        kitsu.load_anime_map()
-        mal.load_anime_map()
+        await anime_mapping.download_maps(force=True)
         return json_response({"status": "Anime map updated."})
     else:
         return json_response({"Error": "Access delined"})
@@ -450,11 +722,107 @@ async def clean_cache(password: str = Query(...)):
         for cache in meta_cache.values():
             cache.expire()
 
+        # Translated catalogs
+        catalog_cache.clear()
+
         return json_response({"status": "Cache cleaned."})
     else:
         return json_response({"Error": "Access delined"})
     
     
+# Runtime stats
+@app.get('/stats')
+async def get_stats(password: str = Query(...)):
+    if password == ADMIN_PASSWORD:
+        return json_response({
+            "meta_builds": meta_flight.stats(),
+            "catalog_builds": catalog_flight.stats(),
+            "catalog_cache_items": len(catalog_cache),
+            "refreshes": refresh_pool.stats(),
+            "prefetches": prefetch_pool.stats(),
+            "language_warmups": tmdb.warm_pool.stats(),
+            "translations": translator.batcher.stats(),
+            "translation_providers": translator.providers.stats(),
+            "tmdb_limiters": [limiter.stats() for limiter in tmdb.TMDB_LIMITERS.values()],
+            "caches": {
+                "meta": cache_stats(meta_cache),
+                "tmdb": cache_stats(tmdb.tmp_cache),
+                "translations": cache_stats(translator.translations_cache),
+                "kitsu_ids": kitsu.kitsu_cache_ids.stats(),
+                "mal_ids": mal.mal_cache_ids.stats(),
+                "neutral": meta_builder.neutral_cache.stats()
+            }
+        })
+    else:
+        return json_response({"Error": "Access delined"})
+
+
+# Prometheus scrape, password as a query param (params in the scrape config)
+@app.get('/metrics')
+async def get_metrics(password: str = Query(...)):
+    if password != ADMIN_PASSWORD:
+        return Response(status_code=403)
+    return Response(metrics.render(collect_metrics()), media_type='text/plain; version=0.0.4')
+
+
+# Scrape time metrics from the stats of caches, builds, pools and limiters
+def collect_metrics() -> list:
+    caches = {
+        "meta": meta_cache.values(),
+        "meta_base": [meta_base_cache],
+        "tmdb": tmdb.tmp_cache.values(),
+        "translations": translator.translations_cache.values(),
+        "videos": meta_builder.videos_cache.values(),
+        "videos_base": [meta_builder.videos_base_cache],
+        "kitsu_ids": [kitsu.kitsu_cache_ids],
+        "mal_ids": [mal.mal_cache_ids],
+        "cinemeta_missing": [meta_builder.cinemeta_missing],
+        "neutral": [meta_builder.neutral_cache]
+    }
+    hits, misses, ratios, items, size = [], [], [], [], []
+    for name, instances in caches.items():
+        memory_hits = sum(cache.hits['memory'] for cache in instances)
+        disk_hits = sum(cache.hits['disk'] for cache in instances)
+        cache_misses = sum(cache.misses for cache in instances)
+        hits += [({ "cache": name, "tier": "memory" }, memory_hits), ({ "cache": name, "tier": "disk" }, disk_hits)]
+        misses.append(({ "cache": name }, cache_misses))
+        ratios.append(({ "cache": name }, (memory_hits + disk_hits) / max(memory_hits + disk_hits + cache_misses, 1)))
+        items.append(({ "cache": name }, sum(len(cache.memory) for cache in instances)))
+        size.append(({ "cache": name }, sum(cache.memory.bytes for cache in instances)))
+    hits.append(({ "cache": "catalog", "tier": "memory" }, catalog_lookups['hit']))
+    misses.append(({ "cache": "catalog" }, catalog_lookups['miss']))
+    ratios.append(({ "cache": "catalog" }, catalog_lookups['hit'] / max(catalog_lookups['hit'] + catalog_lookups['miss'], 1)))
+    items.append(({ "cache": "catalog" }, len(catalog_cache)))
+    items.append(({ "cache": "meta_responses" }, len(meta_responses)))
+    size.append(({ "cache": "meta_responses" }, meta_responses.bytes))
+
+    builds = { "meta": meta_flight.stats(), "catalog": catalog_flight.stats() }
+    pools = { "refresh": refresh_pool.stats(), "prefetch": prefetch_pool.stats(), "language_warmup": tmdb.warm_pool.stats() }
+    limiters = list(tmdb.TMDB_LIMITERS.values())
+
+    return [
+        ('cache_hits_total', 'counter', 'Cache hits per cache and tier', hits),
+        ('cache_misses_total', 'counter', 'Cache misses per cache', misses),
+        ('cache_hit_ratio', 'gauge', 'Cache hits over lookups since start', ratios),
+        ('cache_memory_items', 'gauge', 'Items in the in-memory tier', items),
+        ('cache_memory_bytes', 'gauge', 'Pickled size of the in-memory tier', size),
+        ('cache_memory_budget_bytes', 'gauge', 'Byte limit shared by the in-memory tiers', [({}, cache_store.l1_budget.max_bytes)]),
+        ('builds_in_flight', 'gauge', 'Meta and catalog builds running', [({ "kind": kind }, stats['in_flight']) for kind, stats in builds.items()]),
+        ('build_calls_total', 'counter', 'Meta and catalog build requests', [({ "kind": kind }, stats['calls']) for kind, stats in builds.items()]),
+        ('build_coalesced_total', 'counter', 'Build requests joined to a running build', [({ "kind": kind }, stats['coalesced']) for kind, stats in builds.items()]),
+        ('worker_pool_queued', 'gauge', 'Jobs waiting in the background pools', [({ "pool": pool }, stats['queued']) for pool, stats in pools.items()]),
+        ('worker_pool_jobs_total', 'counter', 'Background pool jobs per result', [
+            ({ "pool": pool, "result": result }, stats[result]) for pool, stats in pools.items() for result in ('submitted', 'dropped', 'completed', 'failed')
+        ]),
+        ('tmdb_limiter_in_flight', 'gauge', 'TMDB requests holding a limiter slot', [({}, sum(limiter.in_flight for limiter in limiters))]),
+        ('tmdb_limiter_slots', 'gauge', 'TMDB limiter slots of all api keys', [({}, sum(limiter.max_concurrency for limiter in limiters))]),
+        ('tmdb_limiter_rate', 'gauge', 'TMDB allowed requests per second of all api keys', [({}, sum(limiter.rate for limiter in limiters))]),
+        ('tmdb_limiter_paused', 'gauge', 'TMDB api keys paused by Retry-After', [({}, sum(limiter.stats()['paused'] for limiter in limiters))]),
+        ('tmdb_limiter_requests_total', 'counter', 'TMDB requests through the limiters', [({}, sum(limiter.requests for limiter in limiters))]),
+        ('tmdb_limiter_throttled_total', 'counter', 'TMDB 429 responses', [({}, sum(limiter.throttled for limiter in limiters))])
+    ]
+
+
 # Toast Translator Logo
 @app.get('/favicon.ico')
 @app.get('/addon-logo.png')
@@ -463,9 +831,14 @@ async def get_poster_placeholder():
 
 # Languages
 @app.get('/languages.json')
-async def get_languages():
+async def get_languages(request: Request):
     with open("languages/languages.json", "r", encoding="utf-8") as f:
-        return json_response(json.load(f))
+        return route_response(request, json.load(f), 'languages')
+
+
+# Per language cache stats, only for used languages
+def cache_stats(caches: dict) -> dict:
+    return { language: cache.stats() for language, cache in caches.items() if cache.hits['memory'] + cache.hits['disk'] + cache.misses > 0 }
 
 
 def decode_base64_url(encoded_url):
@@ -479,17 +852,19 @@ def decode_base64_url(encoded_url):
 async def remove_duplicates(catalog) -> None:
     unique_items = []
     seen_ids = set()
-    
-    for item in catalog['metas']:
+
+    # Mapped ids are resolved in memory, the others fetched concurrently
+    imdb_ids = [mapped_anime_id(item) for item in catalog['metas']]
+    missing = [i for i, item in enumerate(catalog['metas']) if imdb_ids[i] == None and ('kitsu' in item['id'] or 'mal_' in item['id'])]
+    semaphore = asyncio.Semaphore(ANIME_CONVERT_CONCURRENCY)
+    converted = await asyncio.gather(*[convert_anime_id(catalog['metas'][i], semaphore) for i in missing])
+    for i, imdb_id in zip(missing, converted):
+        imdb_ids[i] = imdb_id
+
+    for item, imdb_id in zip(catalog['metas'], imdb_ids):
 
         # Get imdb id and animetype from catalog data
         anime_type = item.get('animeType', None)
-        if 'kitsu' in item['id']:
-            imdb_id, is_converted = await kitsu.convert_to_imdb(item['id'], item['type'])
-        elif 'mal_' in item['id']:
-            imdb_id, is_converted = await mal.convert_to_imdb(item['id'].replace('_',':'), item['type'])
-        elif 'tt' in item['id']:
-            imdb_id = item['id']
         item['imdb_id'] = imdb_id
 
         # Add special, ona, ova, movies
@@ -504,6 +879,25 @@ async def remove_duplicates(catalog) -> None:
     catalog['metas'] = unique_items
 
 
+def mapped_anime_id(item: dict) -> str | None:
+    if 'kitsu' in item['id']:
+        return kitsu.get_mapped_imdb(item['id'])
+    elif 'mal_' in item['id']:
+        return mal.get_mapped_imdb(item['id'].replace('_',':'))
+    elif 'tt' in item['id']:
+        return item['id']
+    return None
+
+
+async def convert_anime_id(item: dict, semaphore: asyncio.Semaphore) -> str:
+    async with semaphore:
+        if 'kitsu' in item['id']:
+            imdb_id, is_converted = await kitsu.convert_to_imdb(item['id'], item['type'])
+        else:
+            imdb_id, is_converted = await mal.convert_to_imdb(item['id'].replace('_',':'), item['type'])
+    return imdb_id
+
+
 def parse_user_settings(user_settings: str) -> dict:
     settings = user_settings.split(',')
     _user_settings = {}
@@ -1,190 +1,269 @@
+from cache import Cache
+from datetime import timedelta
 from api import tmdb
 from api import tvdb
 from api import fanart
-from anime import kitsu
-import httpx
+from anime import anime_index
+from api import http_client
 import asyncio
 import urllib.parse
+import httpx
 import translator
+import ttl_policy
+import overlay
 import math
 import json
+import copy
+import time
 
-REQUEST_TIMEOUT = 100
 MAX_CAST_SEARCH = 3
 TMDB_ERROR_EPISODE_OFFSET = 50
 MAX_TRANSLATE_EPISODES = 20
+# Full TVDB pages are reused for at most this long, new translations show up on the next full rebuild
+STABLE_PAGES_MAX_AGE = timedelta(days=7).total_seconds()
 
 # Load TMDB exceptions
 with open("anime/tmdb_exceptions.json", "r", encoding="utf-8") as f:
     TMDB_EXCEPTIONS = json.load(f) 
 
-async def build_metadata(imdb_id: str, type: str, language: str, tmdb_key: str):
-    tmdb_id = None
-    if 'tt' in imdb_id:
-        tmdb_id = await tmdb.convert_imdb_to_tmdb(imdb_id, language, tmdb_key)
-    if 'tmdb:' in imdb_id: 
-        tmdb_id = imdb_id.replace('tmdb:', '')
-    elif tmdb_id != None and 'tmdb:' in tmdb_id:
-        tmdb_id = tmdb_id.replace('tmdb:', '')
-    elif 'error' in tmdb_id:
-        return { 
-            "meta": {
-                "id": "error:tmdb-key",
-                "name": "Invalid TMDB Key",
-                "description": "Invalid TMDB Key",
-                "poster": "https://i.imgur.com/Zi5UZV3.png",
-                "type": type
-            }
-        }, {}
+# Load languages
+with open("languages/languages.json", "r", encoding="utf-8") as f:
+    LANGUAGES = json.load(f) 
 
-    async with httpx.AsyncClient(follow_redirects=True, timeout=REQUEST_TIMEOUT) as client:
-
-        if type == 'movie':
-            parse_title = 'title'
-            default_video_id = imdb_id
-            has_scheduled_videos = False
-            tasks = [
-                tmdb.get_movie_details(client, tmdb_id, language, tmdb_key),
-                fanart.get_fanart_movie(client, tmdb_id)
-            ]
-
-        elif type == 'series':
-            parse_title = 'name'
-            default_video_id = None
-            has_scheduled_videos = True
-            tasks = [
-                tmdb.get_series_details(client, tmdb_id, language, tmdb_key),
-                fanart.get_fanart_series(client, tmdb_id)
-            ]
-        
-        tasks.append(client.get(f"https://v3-cinemeta.strem.io/meta/{type}/{imdb_id}.json"))
-        data = await asyncio.gather(*tasks)
-        tmdb_data, fanart_data = data[0], data[1]
-        if data[2].status_code == 200:
-            cinemeta_data = data[2].json()
-        else:
-            cinemeta_data = {'meta': {}}
-        
-        # Empty tmdb data
-        if len(tmdb_data) == 0:
-            return {"meta": {}}, cinemeta_data
+# Cache set, stable TVDB episodes kept for incremental refresh as overlays on the base episodes
+videos_base_cache = Cache("./cache/neutral/videos", timedelta(days=30).total_seconds())
+videos_cache = {}
+for language in LANGUAGES:
+    videos_cache[language] = Cache(f"./cache/{language}/videos/tmp", timedelta(days=30).total_seconds())
+
+# Ids not found on Cinemeta
+cinemeta_missing = Cache("./cache/cinemeta/missing", ttl_policy.NEGATIVE_TTL)
+
+# Language independent data (tmdb id, Cinemeta, fanart, credits, external ids) shared by all languages
+neutral_cache = Cache("./cache/neutral/meta", ttl_policy.DEFAULT_NEUTRAL_TTL)
+
+async def build_metadata(imdb_id: str, type: str, language: str, tmdb_key: str):
+    neutral_key = f"{type}:{imdb_id}"
+    # Copies, the built meta and cinemeta data are modified by the callers
+    neutral = copy.deepcopy(await neutral_cache.aget(neutral_key))
 
-        # Invalid TMDB key error
-        if tmdb_data.get('error'):
+    # Built in another language, only the localized details are fetched
+    if neutral != None:
+        tmdb_id = neutral['tmdb_id']
+    else:
+        tmdb_id = None
+        if 'tt' in imdb_id:
+            tmdb_id = await tmdb.convert_imdb_to_tmdb(imdb_id, language, tmdb_key)
+        if 'tmdb:' in imdb_id: 
+            tmdb_id = imdb_id.replace('tmdb:', '')
+        elif tmdb_id != None and 'tmdb:' in tmdb_id:
+            tmdb_id = tmdb_id.replace('tmdb:', '')
+        elif 'error' in tmdb_id:
             return { 
-                    "meta": {
-                        "id": "error:tmdb-key",
-                        "name": "Invalid TMDB Key",
-                        "description": "Invalid TMDB Key",
-                        "poster": "https://i.imgur.com/Zi5UZV3.png",
-                        "type": type
-                    }
+                "meta": {
+                    "id": "error:tmdb-key",
+                    "name": "Invalid TMDB Key",
+                    "description": "Invalid TMDB Key",
+                    "poster": "https://i.imgur.com/Zi5UZV3.png",
+                    "type": type
+                }
             }, {}
-        
-        title = tmdb_data.get(parse_title, '')
-        poster_path = tmdb_data.get('poster_path', '')
-        backdrop_path = tmdb_data.get('backdrop_path', '')
-        slug = f"{type}/{title.lower().replace(' ', '-')}-{tmdb_data.get('imdb_id', '').replace('tt', '')}"
-        logo = extract_logo(fanart_data, tmdb_data, cinemeta_data, language)
-        directors, writers= extract_crew(tmdb_data)
-        cast = extract_cast(tmdb_data)
-        genres = extract_genres(tmdb_data)
-        year = extract_year(tmdb_data, type)
-        trailers = extract_trailers(tmdb_data)
-        rating = cinemeta_data.get('meta', {}).get('imdbRating', '')
-
-        meta = {
-            "meta": {
-                "imdb_id": tmdb_data.get('imdb_id',''),
-                "name": title,
-                "type": type,
-                "cast": cast,
-                "country": (tmdb_data.get('origin_country') or [''])[0],
-                "description": tmdb_data.get('overview', ''),
-                "director": directors,
-                "genre": genres,
-                "imdbRating": rating,
-                "released": tmdb_data.get('release_date', 'TBA')+'T00:00:00.000Z' if type == 'movie' else tmdb_data.get('first_air_date', 'TBA')+'T00:00:00.000Z',
-                "slug": slug,
-                "writer": writers,
-                "year": year,
-                "poster": tmdb.TMDB_POSTER_URL + poster_path if poster_path else None,
-                "background": tmdb.TMDB_BACK_URL + backdrop_path if backdrop_path else None,
-                "logo": logo,
-                "runtime": str(tmdb_data.get('runtime','')) + ' min' if type == 'movie' else extract_series_episode_runtime(tmdb_data, cinemeta_data),
-                "id": 'tmdb:' + str(tmdb_data.get('id', '')),
-                "genres": genres,
-                "releaseInfo": year,
-                "trailerStreams": trailers,
-                "links": build_links(imdb_id, title, slug, rating, cast, writers, directors, genres),
-                "behaviorHints": {
-                    "defaultVideoId": default_video_id,
-                    "hasScheduledVideos": has_scheduled_videos
+
+    if type == 'movie':
+        parse_title = 'title'
+        default_video_id = imdb_id
+        has_scheduled_videos = False
+        get_details = tmdb.get_movie_details
+        get_fanart = fanart.get_fanart_movie
+
+    elif type == 'series':
+        parse_title = 'name'
+        default_video_id = None
+        has_scheduled_videos = True
+        get_details = tmdb.get_series_details
+        get_fanart = fanart.get_fanart_series
+
+    if neutral == None:
+        tmdb_data, fanart_data, cinemeta_data = await asyncio.gather(
+            get_details(tmdb_id, language, tmdb_key),
+            get_fanart(tmdb_id),
+            get_cinemeta_meta(imdb_id, type)
+        )
+    else:
+        tmdb_data = await get_details(tmdb_id, language, tmdb_key, with_neutral=False)
+        fanart_data, cinemeta_data = neutral['fanart'], neutral['cinemeta']
+
+    # Missing or failed Cinemeta meta
+    if 'tt' in imdb_id and not cinemeta_data.get('meta'):
+        ttl_policy.mark_degraded()
+    
+    # Empty tmdb data
+    if len(tmdb_data) == 0:
+        return {"meta": {}}, cinemeta_data
+
+    # Invalid TMDB key error
+    if tmdb_data.get('error'):
+        return { 
+                "meta": {
+                    "id": "error:tmdb-key",
+                    "name": "Invalid TMDB Key",
+                    "description": "Invalid TMDB Key",
+                    "poster": "https://i.imgur.com/Zi5UZV3.png",
+                    "type": type
                 }
+        }, {}
+
+    # Localized details on top of the shared data
+    if neutral == None:
+        neutral_cache.set(neutral_key, copy.deepcopy({
+            "tmdb_id": tmdb_id,
+            "fanart": fanart_data,
+            "cinemeta": cinemeta_data,
+            "credits": tmdb_data.get('credits', { "cast": [], "crew": [] }),
+            "external_ids": tmdb_data.get('external_ids', {})
+        }), ttl_policy.neutral_ttl(tmdb_data, cinemeta_data))
+    else:
+        tmdb_data['credits'] = neutral['credits']
+        tmdb_data['external_ids'] = neutral['external_ids']
+    
+    title = tmdb_data.get(parse_title, '')
+    poster_path = tmdb_data.get('poster_path', '')
+    backdrop_path = tmdb_data.get('backdrop_path', '')
+    slug = f"{type}/{title.lower().replace(' ', '-')}-{tmdb_data.get('imdb_id', '').replace('tt', '')}"
+    logo = extract_logo(fanart_data, tmdb_data, cinemeta_data, language)
+    directors, writers= extract_crew(tmdb_data)
+    cast = extract_cast(tmdb_data)
+    genres = extract_genres(tmdb_data)
+    year = extract_year(tmdb_data, type)
+    trailers = extract_trailers(tmdb_data)
+    rating = cinemeta_data.get('meta', {}).get('imdbRating', '')
+
+    meta = {
+        "meta": {
+            "imdb_id": tmdb_data.get('imdb_id',''),
+            "name": title,
+            "type": type,
+            "cast": cast,
+            "country": (tmdb_data.get('origin_country') or [''])[0],
+            "description": tmdb_data.get('overview', ''),
+            "director": directors,
+            "genre": genres,
+            "imdbRating": rating,
+            "released": tmdb_data.get('release_date', 'TBA')+'T00:00:00.000Z' if type == 'movie' else tmdb_data.get('first_air_date', 'TBA')+'T00:00:00.000Z',
+            "slug": slug,
+            "writer": writers,
+            "year": year,
+            "poster": tmdb.TMDB_POSTER_URL + poster_path if poster_path else None,
+            "background": tmdb.TMDB_BACK_URL + backdrop_path if backdrop_path else None,
+            "logo": logo,
+            "runtime": str(tmdb_data.get('runtime','')) + ' min' if type == 'movie' else extract_series_episode_runtime(tmdb_data, cinemeta_data),
+            "id": 'tmdb:' + str(tmdb_data.get('id', '')),
+            "genres": genres,
+            "releaseInfo": year,
+            "trailerStreams": trailers,
+            "links": build_links(imdb_id, title, slug, rating, cast, writers, directors, genres),
+            "behaviorHints": {
+                "defaultVideoId": default_video_id,
+                "hasScheduledVideos": has_scheduled_videos
             }
         }
+    }
 
-        if type == 'series':
-            meta['meta']['videos'] = await series_build_episodes(client, imdb_id, tmdb_id, tmdb_data.get('seasons', []), tmdb_data['external_ids']['tvdb_id'], tmdb_data['number_of_episodes'], language, tmdb_key)
+    if type == 'series':
+        meta['meta']['videos'] = await series_build_episodes(imdb_id, tmdb_id, tmdb_data, tmdb_data['external_ids']['tvdb_id'], tmdb_data['number_of_episodes'], language, tmdb_key)
 
-        return meta, cinemeta_data
+    return meta, cinemeta_data
 
 
-async def series_build_episodes(client: httpx.AsyncClient, imdb_id: str, tmdb_id: str, seasons: list, tvdb_series_id: int, tmdb_episodes_count: int, language: str, tmdb_key: str) -> list:
-    tasks = []
-    videos = []
+# Cinemeta meta, not found and failed lookups are skipped until the negative TTL
+async def get_cinemeta_meta(imdb_id: str, type: str) -> dict:
+    if 'tt' not in imdb_id or await cinemeta_missing.aget(f"{type}:{imdb_id}") != None:
+        return {'meta': {}}
+
+    try:
+        response = await http_client.get_client('cinemeta').get(f"https://v3-cinemeta.strem.io/meta/{type}/{imdb_id}.json")
+    except httpx.HTTPError as e:
+        print(f"Cinemeta failed fetch: {e!r}")
+        return {'meta': {}}
 
-    # Fetch TMDB request for seasons details
-    for season in seasons:
-        tasks.append(tmdb.get_season_details(client, tmdb_id, season['season_number'], language, tmdb_key))
+    if response.status_code == 200:
+        cinemeta_data = response.json()
+        if cinemeta_data.get('meta'):
+            return cinemeta_data
 
-    tmdb_seasons = await asyncio.gather(*tasks)
+    # Server errors are not a missing meta
+    if response.status_code < 500:
+        cinemeta_missing.set(f"{type}:{imdb_id}", True)
+    return {'meta': {}}
 
+
+async def series_build_episodes(imdb_id: str, tmdb_id: str, tmdb_data: dict, tvdb_series_id: int, tmdb_episodes_count: int, language: str, tmdb_key: str) -> list:
     # Anime tvdb mapping
-    if ('kitsu' in imdb_id or 'mal' in imdb_id or imdb_id in kitsu.imdb_ids_map) and imdb_id not in TMDB_EXCEPTIONS:
+    if ('kitsu' in imdb_id or 'mal' in imdb_id or anime_index.is_anime(imdb_id)) and imdb_id not in TMDB_EXCEPTIONS:
         # Use TVDB data
 
+        # Full pages of previous build are not fetched again until they are too old
+        stable_pages, stable_videos, built_at = 0, [], time.time()
+        previous, base = await asyncio.gather(videos_cache[language].aget(imdb_id), videos_base_cache.aget(imdb_id))
+        if previous != None and base != None and previous['base'] == base['version'] and built_at - previous['built_at'] < STABLE_PAGES_MAX_AGE:
+            stable_pages, stable_videos, built_at = previous['stable_pages'], overlay.apply_videos(base['videos'], previous['overlay']), previous['built_at']
+
         # Extract pre translated episodes
         episodes_tasks = []
         abs_episode_count = tmdb_episodes_count + TMDB_ERROR_EPISODE_OFFSET
         total_pages = math.ceil(abs_episode_count / tvdb.EPISODE_PAGE)
-        for i in range(max(1, total_pages)):
-            episodes_tasks.append(tvdb.get_translated_episodes(client, tvdb_series_id, i, language))
+        for i in range(stable_pages, max(total_pages, stable_pages + 1)):
+            episodes_tasks.append(tvdb.get_translated_episodes(tvdb_series_id, i, language))
         
-        translated_episodes = []
         episodes_tasks_result = await asyncio.gather(*episodes_tasks)
-        for result in episodes_tasks_result:
-            translated_episodes.extend(result['data']['episodes'])
-        
+
         # Build episodes meta
         not_fully_translated_counter = 0
-        for episode in translated_episodes:
-            if episode['seasonNumber'] != 0: # Not for specials
-                video = {
-                    "name": f"{translator.EPISODE_TRANSLATIONS[language]} {episode['number']}" if episode['name'] == None else episode['name'],
-                    "season": episode['seasonNumber'],
-                    "number": episode['number'],
-                    "firstAired": episode['aired'] + 'T05:00:00.000Z' if episode['aired'] is not None else None,
-                    "rating": "0",
-                    "overview": '' if episode['overview'] == None else episode['overview'],
-                    "thumbnail": tvdb.IMAGE_URL + episode['image'] if episode['image'] != None else None,
-                    "id": f"{imdb_id}:{episode['seasonNumber']}:{episode['number']}",
-                    "released": episode['aired'] + 'T05:00:00.000Z' if episode['aired'] is not None else None,
-                    "episode": episode['number'],
-                    "description": ''
-                }
-
-                # Insert not fully translated episode to try translate it with TMDB
-                if episode['seasonNumber'] != 0 and (episode['name'] == None or episode['overview'] == None) and not_fully_translated_counter < MAX_TRANSLATE_EPISODES:
-                    video['tvdb_id'] = episode['id']
-                    not_fully_translated_counter += 1
-                
-                videos.append(video)
-
-        return await translator.translate_episodes(client, videos, language, tmdb_key)
-
+        pages = []
+        for result in episodes_tasks_result:
+            page_videos = []
+            translated = True
+            for episode in result['data']['episodes']:
+                if episode['seasonNumber'] != 0: # Not for specials
+                    video = build_tvdb_video(episode, imdb_id, language)
+
+                    # Insert not fully translated episode to try translate it with TMDB
+                    if episode['name'] == None or episode['overview'] == None:
+                        translated = False
+                        if not_fully_translated_counter < MAX_TRANSLATE_EPISODES:
+                            video['tvdb_id'] = episode['id']
+                            not_fully_translated_counter += 1
+
+                    page_videos.append(video)
+            pages.append((len(result['data']['episodes']), translated, page_videos))
+
+        new_videos = await translator.translate_episodes([video for count, translated, page_videos in pages for video in page_videos], language, tmdb_key)
+        videos = stable_videos + new_videos
+
+        # Leading full and fully translated pages will not change
+        for count, translated, page_videos in pages:
+            if count < tvdb.EPISODE_PAGE or not translated:
+                break
+            stable_pages += 1
+            stable_videos = stable_videos + page_videos
+
+        # Stable episodes are stored as the fields that differ from the ones of the language with most of them
+        if base == None or len(stable_videos) > len(base['videos']):
+            base = { "version": time.time(), "videos": stable_videos }
+            videos_base_cache.set(imdb_id, base)
+        # Diffs are new dicts, the returned videos are modified by the callers
+        videos_cache[language].set(imdb_id, { "stable_pages": stable_pages, "built_at": built_at, "base": base['version'], "overlay": copy.deepcopy(overlay.diff_videos(stable_videos, base['videos'])) })
+        return videos
+
+
+    # TMDB seasons details, ended seasons come from the season cache, airing ones are fetched again
+    season_numbers = [season['season_number'] for season in tmdb_data.get('seasons', [])]
+    airing_season = ttl_policy.current_season(tmdb_data)
+    refresh_seasons = [n for n in season_numbers if airing_season != None and n >= airing_season]
+    tmdb_seasons = await tmdb.get_seasons_details(tmdb_data, language, tmdb_key, season_numbers, refresh=refresh_seasons)
 
     # TMDB episodes builder
+    videos = []
     for season in tmdb_seasons:
         for episode_number, episode in enumerate(season['episodes'], start=1):
             videos.append(
@@ -206,6 +285,22 @@ async def series_build_episodes(client: httpx.AsyncClient, imdb_id: str, tmdb_id
     return videos
 
 
+def build_tvdb_video(episode: dict, imdb_id: str, language: str) -> dict:
+    return {
+        "name": f"{translator.EPISODE_TRANSLATIONS[language]} {episode['number']}" if episode['name'] == None else episode['name'],
+        "season": episode['seasonNumber'],
+        "number": episode['number'],
+        "firstAired": episode['aired'] + 'T05:00:00.000Z' if episode['aired'] is not None else None,
+        "rating": "0",
+        "overview": '' if episode['overview'] == None else episode['overview'],
+        "thumbnail": tvdb.IMAGE_URL + episode['image'] if episode['image'] != None else None,
+        "id": f"{imdb_id}:{episode['seasonNumber']}:{episode['number']}",
+        "released": episode['aired'] + 'T05:00:00.000Z' if episode['aired'] is not None else None,
+        "episode": episode['number'],
+        "description": ''
+    }
+
+
 def extract_series_episode_runtime(tmdb_data: dict, cinemeta_data: dict) -> str:
     runtime = 0
     if len(tmdb_data.get('episode_run_time', [])) > 0:
@@ -0,0 +1,153 @@
+from collections import defaultdict
+import asyncio
+import time
+
+# Prometheus text exposition, process local (single worker)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+LOOP_LAG_INTERVAL = 0.5
+
+registry = []
+
+
+class Counter():
+
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = defaultdict(float)
+        registry.append(self)
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        self.values[label_values] += amount
+
+    def samples(self):
+        for label_values, value in self.values.items():
+            yield self.name, dict(zip(self.labels, label_values)), value
+
+
+class Gauge(Counter):
+
+    type = 'gauge'
+
+    def set(self, value: float, *label_values) -> None:
+        self.values[label_values] = value
+
+
+class Histogram():
+    """
+    Cumulative buckets, sum and count for every label set.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        registry.append(self)
+
+    def observe(self, value: float, *label_values) -> None:
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        for label_values, (counts, total, count) in self.values.items():
+            labels = dict(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", { **labels, "le": format_value(bound) }, cumulative
+            yield f"{self.name}_bucket", { **labels, "le": "+Inf" }, count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+request_duration = Histogram('http_request_duration_seconds', 'Request latency per route', ('method', 'route'))
+requests_total = Counter('http_requests_total', 'Requests per route and status code', ('method', 'route', 'status'))
+upstream_duration = Histogram('upstream_request_duration_seconds', 'Upstream call latency until response headers', ('upstream',))
+upstream_responses = Counter('upstream_responses_total', 'Upstream responses per status code, error for failed calls', ('upstream', 'status'))
+loop_lag = Histogram('event_loop_lag_seconds', 'Event loop scheduling delay', buckets=LOOP_LAG_BUCKETS)
+loop_lag_last = Gauge('event_loop_lag_last_seconds', 'Last measured event loop scheduling delay')
+
+lag_task = None
+
+
+def observe_request(method: str, route: str, status_code: int, duration: float) -> None:
+    request_duration.observe(duration, method, route)
+    requests_total.inc(method, route, str(status_code))
+
+
+def observe_upstream(upstream: str, duration: float, status_code: int | None) -> None:
+    upstream_duration.observe(duration, upstream)
+    upstream_responses.inc(upstream, str(status_code) if status_code != None else 'error')
+
+
+# Event loop lag, how late a periodic sleep wakes up
+async def monitor_loop_lag():
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(time.monotonic() - start - LOOP_LAG_INTERVAL, 0)
+        loop_lag.observe(lag)
+        loop_lag_last.set(lag)
+
+
+def start_lag_monitor():
+    global lag_task
+    lag_task = asyncio.create_task(monitor_loop_lag())
+
+
+async def stop_lag_monitor():
+    if lag_task != None:
+        lag_task.cancel()
+        await asyncio.gather(lag_task, return_exceptions=True)
+
+
+def render(collected: list = []) -> str:
+    """
+    Registered metrics and the ones collected at scrape time,
+    given as (name, type, help, [(labels, value)]).
+    """
+    lines = []
+    for metric in registry:
+        lines += format_metric(metric.name, metric.type, metric.help, metric.samples())
+    for name, type, help, samples in collected:
+        lines += format_metric(name, type, help, ((name, labels, value) for labels, value in samples))
+    return '\n'.join(lines) + '\n'
+
+
+def format_metric(name: str, type: str, help: str, samples) -> list[str]:
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {type}"]
+    for sample_name, labels, value in samples:
+        if labels:
+            label_text = ','.join(f'{key}="{escape_label(str(label))}"' for key, label in labels.items())
+            lines.append(f"{sample_name}{{{label_text}}} {format_value(value)}")
+        else:
+            lines.append(f"{sample_name} {format_value(value)}")
+    return lines
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value: float) -> str:
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
@@ -0,0 +1,65 @@
+# Language overlays: a value built in one language is stored once as the base,
+# the other languages only store the fields that differ from it
+
+
+def diff(value: dict, base: dict) -> dict:
+    overlay = {}
+    changes = { key: item for key, item in value.items() if key not in base or base[key] != item }
+    removed = [key for key in base if key not in value]
+    if changes:
+        overlay['set'] = changes
+    if removed:
+        overlay['unset'] = removed
+    return overlay
+
+
+def apply(base: dict, overlay: dict) -> dict:
+    value = { **base, **overlay.get('set', {}) }
+    for key in overlay.get('unset', []):
+        value.pop(key, None)
+    return value
+
+
+def diff_videos(videos: list, base_videos: list) -> dict:
+    """
+    Changed fields of every video matched by id, with the order of the ids
+    when it differs from the base. Lists without unique ids are kept whole.
+    """
+    ids = [video.get('id') for video in videos]
+    base_ids = [video.get('id') for video in base_videos]
+    if None in ids or len(set(ids)) < len(ids) or len(set(base_ids)) < len(base_ids):
+        return { "videos": videos }
+
+    base = dict(zip(base_ids, base_videos))
+    overlay = { "changes": { id: changes for id, video in zip(ids, videos) if (changes := diff(video, base.get(id, {}))) } }
+    if ids != base_ids:
+        overlay['ids'] = ids
+    return overlay
+
+
+def apply_videos(base_videos: list, overlay: dict) -> list:
+    if 'videos' in overlay:
+        return overlay['videos']
+
+    base = { video.get('id'): video for video in base_videos }
+    changes = overlay['changes']
+    return [apply(base.get(id, {}), changes.get(id, {})) for id in overlay.get('ids', list(base))]
+
+
+def diff_meta(meta: dict, base: dict) -> dict:
+    inner, base_inner = meta.get('meta', {}), base.get('meta', {})
+    overlay = {
+        "outer": diff({ key: value for key, value in meta.items() if key != 'meta' }, { key: value for key, value in base.items() if key != 'meta' }),
+        "meta": diff({ key: value for key, value in inner.items() if key != 'videos' }, { key: value for key, value in base_inner.items() if key != 'videos' })
+    }
+    if 'videos' in inner:
+        overlay['videos'] = diff_videos(inner['videos'], base_inner.get('videos', []))
+    return overlay
+
+
+def apply_meta(base: dict, overlay: dict) -> dict:
+    base_inner = base.get('meta', {})
+    inner = apply({ key: value for key, value in base_inner.items() if key != 'videos' }, overlay['meta'])
+    if 'videos' in overlay:
+        inner['videos'] = apply_videos(base_inner.get('videos', []), overlay['videos'])
+    return { **apply({ key: value for key, value in base.items() if key != 'meta' }, overlay['outer']), "meta": inner }
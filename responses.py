@@ -0,0 +1,67 @@
+from fastapi import Request, Response
+import hashlib
+import orjson
+import gzip
+
+# Brotli needs the optional brotli package (pip install brotli)
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def dumps(data) -> bytes:
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+
+def encode_json(data) -> dict:
+    """
+    Serialize once for the cache: plain and compressed bodies with their ETag.
+    """
+    body = dumps(data)
+    return {
+        "etag": f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"',
+        "identity": body,
+        "gzip": gzip.compress(body, GZIP_LEVEL, mtime=0),
+        "br": brotli.compress(body, quality=BROTLI_QUALITY) if brotli != None else None
+    }
+
+
+def encoded_response(request: Request, encoded: dict) -> Response:
+    """
+    Cached bytes sent as they are, compressed when the client accepts it.
+    """
+    accepted = accepted_encodings(request)
+    headers = {
+        "ETag": encoded['etag'],
+        "Vary": "Accept-Encoding"
+    }
+
+    # Client copy still valid
+    if etag_matches(request.headers.get('if-none-match'), encoded['etag']):
+        return Response(status_code=304, headers=headers)
+
+    for encoding in ('br', 'gzip'):
+        if encoding in accepted and encoded.get(encoding) != None:
+            headers['Content-Encoding'] = encoding
+            return Response(encoded[encoding], media_type='application/json', headers=headers)
+    return Response(encoded['identity'], media_type='application/json', headers=headers)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+
+def accepted_encodings(request: Request) -> set:
+    encodings = set()
+    for item in request.headers.get('accept-encoding', '').split(','):
+        encoding, _, params = item.strip().partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0'):
+            encodings.add(encoding.strip().lower())
+    return encodings
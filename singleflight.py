@@ -0,0 +1,41 @@
+import asyncio
+
+
+class SingleFlight():
+    """
+    Coalesce concurrent calls with the same key into a single execution.
+    Every caller awaits the same task and gets the same result.
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        self.calls += 1
+        task = self.in_flight.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+
+        # A disconnected caller must not cancel the shared task
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+
+    def is_running(self, key) -> bool:
+        return key in self.in_flight
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self.in_flight)
+        }
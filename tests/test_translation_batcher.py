@@ -0,0 +1,45 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from translation_batcher import TranslationBatcher, chunk_text, encoded_length
+
+
+def test_chunk_text_four_byte_characters():
+    # 12 encoded characters each
+    text = '😀' * 200
+    chunks = chunk_text(text, 1500)
+    assert len(chunks) > 1
+    assert all(encoded_length(chunk) <= 1500 for chunk in chunks)
+    assert ''.join(chunks).replace(' ', '') == text
+
+
+def test_chunk_text_mixed_widths():
+    text = 'a' * 700 + '中' * 300 + '😀' * 100
+    chunks = chunk_text(text, 1500)
+    assert all(encoded_length(chunk) <= 1500 for chunk in chunks)
+    assert ''.join(chunks).replace(' ', '') == text
+
+
+def test_translate_four_byte_characters():
+    async def send_batch(texts, source, target):
+        return texts
+
+    async def translate():
+        batcher = TranslationBatcher(send_batch, window=0)
+        return await batcher.translate('😀' * 200, 'en', 'it')
+
+    assert asyncio.run(translate()).replace(' ', '') == '😀' * 200
+
+
+def test_translate_character_over_limit():
+    async def send_batch(texts, source, target):
+        return texts
+
+    async def translate():
+        batcher = TranslationBatcher(send_batch, window=0, max_chars=5)
+        return await batcher.translate('😀😀', 'en', 'it')
+
+    assert asyncio.run(translate()) == '😀 😀'
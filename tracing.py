@@ -0,0 +1,100 @@
+from contextvars import ContextVar
+import json
+import time
+import os
+
+# Requests slower than this are logged with their trace (0 disables)
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 5000))
+# Server-Timing response header, opt in since it exposes upstream timings to any origin
+SERVER_TIMING = os.getenv('SERVER_TIMING', '0') == '1'
+
+# Trace of the request being served, shared with the tasks it starts
+current_trace: ContextVar['Trace | None'] = ContextVar('current_trace', default=None)
+
+
+class Trace():
+    """
+    Per request upstream spans and cache lookups.
+    Upstream time is the sum of every call, concurrent calls can exceed the request time.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.upstreams = {}
+        self.caches = {}
+
+    def upstream(self, name: str) -> dict:
+        span = self.upstreams.get(name)
+        if span is None:
+            span = self.upstreams[name] = { "count": 0, "time": 0.0, "wait": 0.0, "retries": 0, "errors": 0 }
+        return span
+
+    def cache(self, name: str) -> dict:
+        lookups = self.caches.get(name)
+        if lookups is None:
+            lookups = self.caches[name] = { "hit": 0, "miss": 0 }
+        return lookups
+
+    def duration_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+    def server_timing(self) -> str:
+        metrics = [f"total;dur={self.duration_ms():.1f}"]
+        for name, span in self.upstreams.items():
+            desc = f"{span['count']} calls, {span['retries']} retries, {span['errors']} errors"
+            if span['wait']:
+                desc += f", {span['wait'] * 1000:.0f} ms queued"
+            metrics.append(f'{name};dur={span["time"] * 1000:.1f};desc="{desc}"')
+        for name, lookups in self.caches.items():
+            metrics.append(f'cache-{name};desc="{lookups["hit"]} hit, {lookups["miss"]} miss"')
+        return ', '.join(metrics)
+
+    def summary(self) -> dict:
+        return {
+            "duration_ms": round(self.duration_ms(), 1),
+            "upstreams": {
+                name: { **span, "time": round(span['time'] * 1000, 1), "wait": round(span['wait'] * 1000, 1) }
+                for name, span in self.upstreams.items()
+            },
+            "caches": self.caches
+        }
+
+
+def start() -> Trace:
+    trace = Trace()
+    current_trace.set(trace)
+    return trace
+
+
+# Recorders are no-op outside of a request (background refreshes and prefetches)
+def record_call(upstream: str, duration: float, error: bool = False) -> None:
+    trace = current_trace.get()
+    if trace is not None:
+        span = trace.upstream(upstream)
+        span['count'] += 1
+        span['time'] += duration
+        span['errors'] += error
+
+
+def record_retry(upstream: str) -> None:
+    trace = current_trace.get()
+    if trace is not None:
+        trace.upstream(upstream)['retries'] += 1
+
+
+def record_wait(upstream: str, duration: float) -> None:
+    trace = current_trace.get()
+    if trace is not None:
+        trace.upstream(upstream)['wait'] += duration
+
+
+def record_cache(name: str, hit: bool) -> None:
+    trace = current_trace.get()
+    if trace is not None:
+        trace.cache(name)['hit' if hit else 'miss'] += 1
+
+
+def log_slow(trace: Trace, route: str, params: dict, status_code: int) -> None:
+    duration = trace.duration_ms()
+    if SLOW_REQUEST_MS and duration >= SLOW_REQUEST_MS:
+        print(json.dumps({ "event": "slow_request", "route": route, "params": params, "status": status_code, **trace.summary() }))
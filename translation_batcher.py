@@ -0,0 +1,165 @@
+import urllib.parse
+import asyncio
+import re
+
+BATCH_WINDOW = 0.02
+MAX_BATCH_CHARS = 1500
+MAX_BATCH_ITEMS = 50
+
+# Separator protocol for backends without native batch support
+BATCH_SEPARATOR = '\n|||\n'
+BATCH_SPLIT_PATTERN = re.compile(r'\s*\|\s*\|\s*\|\s*')
+
+
+class TranslationBatcher():
+    """
+    Collect texts to translate during a short window, dedupe them and send them
+    to the backend in size bounded batches. Every caller gets its own result back.
+    send_batch(texts, source, target) must return a list with a translation
+    (or None on failure) for every text.
+    """
+
+    def __init__(self, send_batch, window: float = BATCH_WINDOW, max_chars: int = MAX_BATCH_CHARS, max_items: int = MAX_BATCH_ITEMS):
+        self.send_batch = send_batch
+        self.window = window
+        self.max_chars = max_chars
+        self.max_items = max_items
+        self.pending = {}
+        self.pending_chars = {}
+        self.timers = {}
+        self.tasks = set()
+        self.requested = 0
+        self.sent = 0
+        self.batches = 0
+
+    async def translate(self, text: str, source: str, target: str) -> str | None:
+        # Long texts are split and translated in chunks, a text that can not be split is sent as is
+        chunks = chunk_text(text, self.max_chars) if encoded_length(text) > self.max_chars else []
+        if len(chunks) > 1:
+            translations = await asyncio.gather(*[self.translate(chunk, source, target) for chunk in chunks])
+            if any(translation is None for translation in translations):
+                return None
+            return ' '.join(translations)
+
+        self.requested += 1
+        key = (source, target)
+        group = self.pending.setdefault(key, {})
+        future = group.get(text)
+
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            group[text] = future
+            self.pending_chars[key] = self.pending_chars.get(key, 0) + encoded_length(text) + encoded_length(BATCH_SEPARATOR)
+
+            if len(group) >= self.max_items or self.pending_chars[key] >= self.max_chars:
+                self.flush(key)
+            elif key not in self.timers:
+                self.timers[key] = asyncio.get_running_loop().call_later(self.window, self.flush, key)
+
+        return await asyncio.shield(future)
+
+    def flush(self, key: tuple) -> None:
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+        group = self.pending.pop(key, {})
+        self.pending_chars.pop(key, None)
+        if group:
+            task = asyncio.ensure_future(self.send(key, group))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def send(self, key: tuple, group: dict) -> None:
+        source, target = key
+        batches = pack_batches(list(group), self.max_chars, self.max_items)
+        self.sent += len(group)
+        self.batches += len(batches)
+        results = await asyncio.gather(*[self.send_batch(batch, source, target) for batch in batches], return_exceptions=True)
+
+        for batch, translations in zip(batches, results):
+            if isinstance(translations, Exception):
+                print(f"Translation batch error: {translations}")
+                translations = [None] * len(batch)
+            for text, translation in zip(batch, translations):
+                if not group[text].done():
+                    group[text].set_result(translation)
+
+    def stats(self) -> dict:
+        return {
+            "requested": self.requested,
+            "sent": self.sent,
+            "batches": self.batches
+        }
+
+
+def encoded_length(text: str) -> int:
+    return len(urllib.parse.quote(text))
+
+
+# Group texts in batches limited by encoded size and number of items
+def pack_batches(texts: list[str], max_chars: int, max_items: int) -> list[list[str]]:
+    batches = []
+    batch = []
+    size = 0
+
+    for text in texts:
+        text_size = encoded_length(text) + encoded_length(BATCH_SEPARATOR)
+        if batch and (size + text_size > max_chars or len(batch) >= max_items):
+            batches.append(batch)
+            batch = []
+            size = 0
+        batch.append(text)
+        size += text_size
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+# Split a long text on sentences (or words) in chunks within the size limit
+def chunk_text(text: str, max_chars: int) -> list[str]:
+    chunks = []
+    chunk = ''
+
+    for part in split_parts(text, max_chars):
+        candidate = f"{chunk} {part}" if chunk else part
+        if chunk and encoded_length(candidate) > max_chars:
+            chunks.append(chunk)
+            chunk = part
+        else:
+            chunk = candidate
+
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def split_parts(text: str, max_chars: int) -> list[str]:
+    parts = []
+    for sentence in re.split(r'(?<=[.!?])\s+', text.strip()):
+        if encoded_length(sentence) <= max_chars:
+            parts.append(sentence)
+            continue
+        for word in sentence.split():
+            # Hard cut for a single huge word, on the measured encoded length (up to 12 per character)
+            while encoded_length(word) > max_chars:
+                cut = min(len(word), max_chars)
+                while cut > 1 and (size := encoded_length(word[:cut])) > max_chars:
+                    cut = max(1, min(cut - 1, cut * max_chars // size))
+                parts.append(word[:cut])
+                word = word[cut:]
+            parts.append(word)
+    return parts
+
+
+# Separator protocol helpers
+def join_batch(texts: list[str]) -> str:
+    return BATCH_SEPARATOR.join(texts)
+
+
+def split_batch(translated: str, count: int) -> list[str] | None:
+    parts = [part.strip() for part in BATCH_SPLIT_PATTERN.split(translated.strip())]
+    if len(parts) != count:
+        return None
+    return parts
@@ -1,8 +1,8 @@
 from cache import Cache
+from translation_batcher import TranslationBatcher
+from api import translation_providers
 import api.tmdb as tmdb
-import urllib.parse
 import asyncio
-import httpx
 import json
 import os
 
@@ -29,16 +29,21 @@ for language in LANGUAGES:
 RATINGS_SERVER = os.getenv('TR_SERVER', 'https://ca6771aaa821-toast-ratings.baby-beamup.club')
 TSP_API_KEY = os.getenv('TSP_API_KEY')
 
+# Translation backends
+providers = translation_providers.load_providers()
+batcher = TranslationBatcher(providers.translate_batch)
 
-async def translate_with_api(client: httpx.AsyncClient, text: str, language: str, source='en') -> str:
 
-    translation = translations_cache[language].get(text)
+async def translate_with_api(text: str, language: str, source='en') -> str:
+
+    translation = await translations_cache[language].aget(text)
     target = language.split('-')[0]
     if translation == None and text != None and text != '':
-        api_url = f"https://lingva-translate-azure.vercel.app/api/v1/{source}/{target}/{urllib.parse.quote(text)}"
+        translated_text = await batcher.translate(text, source, target)
 
-        response = await client.get(api_url)
-        translated_text = response.json().get('translation', '')
+        # Translation failed, keep original text and retry next time
+        if translated_text == None:
+            return text
         translations_cache[language].set(text, translated_text)
     else:
         translated_text = translation
@@ -46,12 +51,12 @@ async def translate_with_api(client: httpx.AsyncClient, text: str, language: str
     return translated_text
 
 
-async def translate_episodes_with_api(client: httpx.AsyncClient, episodes: list[dict], language: str):
+async def translate_episodes_with_api(episodes: list[dict], language: str):
     tasks = []
 
     for episode in episodes:
-        tasks.append(translate_with_api(client, episode.get('title', ''), language)),
-        tasks.append(translate_with_api(client, episode.get('overview', ''), language))
+        tasks.append(translate_with_api(episode.get('title', ''), language)),
+        tasks.append(translate_with_api(episode.get('overview', ''), language))
 
     translations = await asyncio.gather(*tasks)
 
@@ -122,7 +127,7 @@ def translate_catalog(original: dict, tmdb_meta: dict, top_stream_poster, toast_
     return new_catalog
 
 
-async def translate_episodes(client: httpx.AsyncClient, original_episodes: list[dict], language: str, tmdb_key: str):
+async def translate_episodes(original_episodes: list[dict], language: str, tmdb_key: str):
     translate_index = []
     tasks = []
     new_episodes = original_episodes
@@ -130,7 +135,7 @@ async def translate_episodes(client: httpx.AsyncClient, original_episodes: list[
     # Select not translated episodes
     for i, episode in enumerate(original_episodes):
         if 'tvdb_id' in episode:
-            tasks.append(tmdb.get_tmdb_data(client, episode['tvdb_id'], "tvdb_id", language, tmdb_key))
+            tasks.append(tmdb.get_tmdb_data(episode['tvdb_id'], "tvdb_id", language, tmdb_key))
             translate_index.append(i)
 
     translations = await asyncio.gather(*tasks)
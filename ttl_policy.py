@@ -0,0 +1,167 @@
+from datetime import date, datetime, timedelta, timezone
+from contextvars import ContextVar
+import re
+import os
+
+# Not found, empty and failed lookups
+NEGATIVE_TTL = float(os.getenv('NEGATIVE_CACHE_TTL', timedelta(hours=6).total_seconds()))
+
+# Meta
+MIN_META_TTL = timedelta(hours=1).total_seconds()
+AIRING_META_TTL = timedelta(hours=12).total_seconds()
+MAX_AIRING_META_TTL = timedelta(days=1).total_seconds()
+RECENT_META_TTL = timedelta(days=3).total_seconds()
+ENDED_META_TTL = timedelta(days=14).total_seconds()
+OLD_META_TTL = timedelta(days=30).total_seconds()
+
+# TMDB
+RECENT_TMDB_TTL = timedelta(days=1).total_seconds()
+DEFAULT_TMDB_TTL = timedelta(days=7).total_seconds()
+OLD_TMDB_TTL = timedelta(days=30).total_seconds()
+
+# Language independent data (Cinemeta, fanart, credits)
+RECENT_NEUTRAL_TTL = timedelta(days=1).total_seconds()
+DEFAULT_NEUTRAL_TTL = timedelta(days=3).total_seconds()
+OLD_NEUTRAL_TTL = timedelta(days=14).total_seconds()
+
+# Seasons
+AIRING_SEASON_TTL = timedelta(hours=12).total_seconds()
+ENDED_SEASON_TTL = timedelta(days=365).total_seconds()
+
+RECENT_DAYS = 90
+OLD_DAYS = 365
+
+# Meta build in progress, degraded when an input failed or came from a negative cache
+current_build: ContextVar['dict | None'] = ContextVar('current_build', default=None)
+
+
+def start_build() -> dict:
+    build = { "degraded": False }
+    current_build.set(build)
+    return build
+
+
+# No-op outside of a meta build
+def mark_degraded() -> None:
+    build = current_build.get()
+    if build is not None:
+        build['degraded'] = True
+
+
+def is_degraded() -> bool:
+    build = current_build.get()
+    return build is not None and build['degraded']
+
+
+def meta_ttl(meta: dict, degraded: bool = False) -> float:
+    """
+    Cache expiry of a built meta, derived from type and release status.
+    Metas built from failed inputs are retried after the negative TTL.
+    """
+    if degraded:
+        return min(meta_ttl(meta), NEGATIVE_TTL)
+
+    meta = meta.get('meta', {})
+    today = datetime.now(timezone.utc).date()
+
+    if meta.get('type') == 'movie':
+        released = parse_date(meta.get('released'))
+        if released == None or released > today:
+            return AIRING_META_TTL
+        return age_ttl((today - released).days, RECENT_META_TTL, ENDED_META_TTL, OLD_META_TTL)
+
+    # Series, refresh right after the next episode airs
+    now = datetime.now(timezone.utc)
+    upcoming = [released for released in (parse_datetime(video.get('released')) for video in meta.get('videos', [])) if released != None and released > now]
+    if upcoming:
+        return min(max((min(upcoming) - now).total_seconds(), MIN_META_TTL), MAX_AIRING_META_TTL)
+
+    if is_ended(meta):
+        last_release = max((released for released in (parse_date(video.get('released')) for video in meta.get('videos', [])) if released != None), default=None)
+        if last_release != None and (today - last_release).days > OLD_DAYS:
+            return OLD_META_TTL
+        return ENDED_META_TTL
+
+    return AIRING_META_TTL
+
+
+def tmdb_ttl(data: dict) -> float:
+    """
+    Cache expiry of a TMDB find result, older contents change less often.
+    Empty results are retried after the negative TTL.
+    """
+    today = datetime.now(timezone.utc).date()
+    for key in ('movie_results', 'tv_results'):
+        for result in data.get(key) or []:
+            released = parse_date(result.get('release_date') or result.get('first_air_date'))
+            if released == None or released > today:
+                return RECENT_TMDB_TTL
+            return age_ttl((today - released).days, RECENT_TMDB_TTL, DEFAULT_TMDB_TTL, OLD_TMDB_TTL)
+    return NEGATIVE_TTL
+
+
+def neutral_ttl(tmdb_data: dict, cinemeta_data: dict) -> float:
+    """
+    Cache expiry of the data shared by all languages, ratings and artwork
+    of older contents change less often. Missing Cinemeta metas are retried
+    after the negative TTL, as well as data of degraded builds.
+    """
+    if not cinemeta_data.get('meta') or is_degraded():
+        return NEGATIVE_TTL
+
+    today = datetime.now(timezone.utc).date()
+    released = parse_date(tmdb_data.get('release_date') or tmdb_data.get('last_air_date') or tmdb_data.get('first_air_date'))
+    if released == None or released > today:
+        return RECENT_NEUTRAL_TTL
+    return age_ttl((today - released).days, RECENT_NEUTRAL_TTL, DEFAULT_NEUTRAL_TTL, OLD_NEUTRAL_TTL)
+
+
+# Ended seasons will not change, airing seasons are refreshed often
+def season_ttl(season_number: int, series_data: dict) -> float:
+    airing_season = current_season(series_data)
+    if airing_season != None and season_number >= airing_season:
+        return AIRING_SEASON_TTL
+    return ENDED_SEASON_TTL
+
+
+# Season still airing (None for ended series)
+def current_season(series_data: dict) -> int | None:
+    if series_data.get('status') in ('Ended', 'Canceled'):
+        return None
+
+    return max(
+        (series_data.get('last_episode_to_air') or {}).get('season_number', 0),
+        (series_data.get('next_episode_to_air') or {}).get('season_number', 0)
+    )
+
+
+def age_ttl(age_days: int, recent_ttl: float, default_ttl: float, old_ttl: float) -> float:
+    if age_days < RECENT_DAYS:
+        return recent_ttl
+    elif age_days > OLD_DAYS:
+        return old_ttl
+    return default_ttl
+
+
+# Year range with an end year (ex. 2008-2013) means ended series
+def is_ended(meta: dict) -> bool:
+    release_info = str(meta.get('releaseInfo') or meta.get('year') or '')
+    return re.fullmatch(r'\d{4}\s*[-–]\s*\d{4}', release_info.strip()) != None
+
+
+def parse_date(value) -> date | None:
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def parse_datetime(value) -> datetime | None:
+    released = parse_date(value)
+    if released == None:
+        return None
+    try:
+        released_at = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return datetime(released.year, released.month, released.day, tzinfo=timezone.utc)
+    return released_at if released_at.tzinfo != None else released_at.replace(tzinfo=timezone.utc)